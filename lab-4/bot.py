@@ -6,9 +6,9 @@ from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from dotenv import load_dotenv
+from fsm_storage import create_storage, start_storage
 
 # Настройка логгера
 logging.basicConfig(
@@ -23,7 +23,8 @@ API_TOKEN = os.getenv("API_TOKEN")
 
 # Инициализация бота и хранилища
 bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
+# Хранилище состояний FSM выбирается переменной окружения FSM_STORAGE (memory, postgres, sqlite)
+storage = create_storage()
 dp = Dispatcher(storage=storage) 
 
 # Хранение курсов валют
@@ -219,6 +220,7 @@ async def handle_other_messages(message: types.Message):
 
 
 async def main():
+    await start_storage(storage)
     await dp.start_polling(bot, skip_updates=True)
 
 asyncio.run(main())
\ No newline at end of file
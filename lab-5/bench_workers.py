@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from aiohttp import web
+
+# Пропускная способность bot1 в режиме с несколькими процессами в зависимости
+# от числа обработчиков. Обновления раздаются так же, как в supervisor (по chat_id),
+# Bot API заменён локальной заглушкой, база - PostgreSQL из переменных окружения DB_*.
+# Пример запуска:
+#   python bench_workers.py --workers 1,2,4 --updates 20000
+# Каждое обновление - конвертация одной строкой ("250 usd"): один запрос к базе и один ответ
+
+parser = argparse.ArgumentParser(description="Пропускная способность bot1 при разном числе процессов")
+parser.add_argument("--workers", default="1,2,4", help="Числа обработчиков через запятую")
+parser.add_argument("--updates", type=int, default=10000, help="Количество обновлений в одном прогоне")
+parser.add_argument("--chats", type=int, default=1000, help="Количество имитируемых чатов")
+parser.add_argument("--api-port", type=int, default=8082, help="Порт заглушки Bot API")
+args = parser.parse_args()
+
+# bot1 читает настройки при импорте (в том числе в процессах-обработчиках), поэтому задаём их заранее
+os.environ.setdefault("API_TOKEN", "123:abc")
+os.environ["BOT_API_URL"] = f"http://127.0.0.1:{args.api_port}"
+
+import bot1
+
+# Журнал на каждое обновление только мешает замерам (модуль импортируется и в обработчиках)
+logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+# Заглушка Bot API считает ответы бота, чтобы понять, когда прогон завершён
+replies = {"count": 0, "expected": 0, "done": None}
+
+async def handle_bot_api(request: web.Request) -> web.Response:
+    method = request.match_info["method"]
+    data = await request.json() if request.content_type == "application/json" else dict(await request.post())
+    if method != "sendMessage":
+        return web.json_response({"ok": True, "result": True})
+    replies["count"] += 1
+    if replies["count"] >= replies["expected"]:
+        replies["done"].set()
+    return web.json_response({"ok": True, "result": {
+        "message_id": 1,
+        "date": int(time.time()),
+        "chat": {"id": int(data.get("chat_id", 1)), "type": "private"},
+        "text": data.get("text", "")
+    }})
+
+def make_update(update_id: int, chat_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "text": "250 usd"
+        }
+    }
+
+# Подача обновлений и ожидание всех ответов
+async def send_updates(queues, processes, first_id: int, count: int, chats: int):
+    replies["count"] = 0
+    replies["expected"] = count
+    replies["done"] = asyncio.Event()
+    for offset in range(count):
+        await bot1.dispatch_update(queues, processes, make_update(first_id + offset, 1_000_000 + offset % chats))
+    await replies["done"].wait()
+
+async def run(workers: int) -> float:
+    queues, processes = bot1.start_workers(workers)
+    try:
+        # Прогрев: процессы запускаются, открывают пулы и подготавливают запросы
+        await send_updates(queues, processes, 1, workers * 10, workers * 10)
+        started = time.perf_counter()
+        await send_updates(queues, processes, 1_000, args.updates, args.chats)
+        return args.updates / (time.perf_counter() - started)
+    finally:
+        await asyncio.to_thread(bot1.stop_workers, queues, processes)
+
+async def main():
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle_bot_api)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.api_port).start()
+    await bot1.init_db()
+
+    try:
+        print(f"{'Обработчиков':>12} {'обновлений/с':>14} {'ускорение':>10}")
+        baseline = None
+        for workers in [int(value) for value in args.workers.split(",")]:
+            rps = await run(workers)
+            baseline = baseline or rps
+            print(f"{workers:>12} {rps:>14.1f} {rps / baseline:>10.2f}")
+    finally:
+        await runner.cleanup()
+        await bot1.bot.session.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
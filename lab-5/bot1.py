@@ -2,15 +2,23 @@ import asyncio
 import asyncpg
 import re
 import logging
+import multiprocessing
 import os
+import queue
+import threading
+import time
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
 from dotenv import load_dotenv
+from fsm_storage import create_storage, start_storage
+from migrations import run_migrations
+from queries import create_pool, report_pool_stats
 from decimal import Decimal
 
 # Настройка логгера
@@ -24,7 +32,19 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 API_TOKEN = os.getenv("API_TOKEN")
 ADMIN_COMMAND = os.getenv("ADMIN_COMMAND")
-
+# Адрес Bot API (например, локальный сервер или заглушка для тестов); по умолчанию - api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL")
+
+# Количество процессов-обработчиков: при BOT_WORKERS > 1 основной процесс только
+# получает обновления и раздаёт их обработчикам по chat_id
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Размер очереди обновлений каждого обработчика
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+# Сколько обновлений обработчик обрабатывает одновременно
+WORKER_MAX_CONCURRENCY = int(os.getenv("WORKER_MAX_CONCURRENCY", "100"))
+# Упавший обработчик перезапускается, но если он проработал меньше этого времени
+# (в секундах), перезапуск не поможет - основной процесс останавливается с ошибкой
+WORKER_MIN_UPTIME = float(os.getenv("WORKER_MIN_UPTIME", "10"))
 
 # Параметры подключения к PostgreSQL
 DB_CONFIG = {
@@ -35,31 +55,45 @@ DB_CONFIG = {
     "database": os.getenv("DB_NAME"),
 }
 
+# Параметры пула соединений
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# Через сколько секунд простоя лишние соединения закрываются (0 - никогда)
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))
+# Размер кэша неименованных подготовленных запросов asyncpg на соединение
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+# Как часто писать в лог состояние пула и статистику запросов (в секундах)
+DB_STATS_INTERVAL = float(os.getenv("DB_STATS_INTERVAL", "60"))
+
+# Пул соединений с подготовленными запросами бота (см. queries.py)
 async def create_db_pool():
-    return await asyncpg.create_pool(**DB_CONFIG)
+    return await create_pool(
+        **DB_CONFIG,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE
+    )
 
 async def init_db():
     conn = await asyncpg.connect(**DB_CONFIG)
     try:
-        await conn.execute('''
-        CREATE TABLE IF NOT EXISTS admins (
-            id SERIAL PRIMARY KEY,
-            chat_id VARCHAR UNIQUE
-        )
-        ''')
-        await conn.execute('''
-        CREATE TABLE IF NOT EXISTS currencies (
-            id SERIAL PRIMARY KEY,
-            currency_name VARCHAR UNIQUE,
-            rate NUMERIC
-        )
-        ''')
+        # Схема создаётся и обновляется версионными миграциями (см. migrations.py)
+        await run_migrations(conn)
     finally:
         await conn.close()
 
+# Функция для создания бота (с другим адресом Bot API, если он задан)
+def create_bot() -> Bot:
+    if BOT_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL))
+        return Bot(token=API_TOKEN, session=session)
+    return Bot(token=API_TOKEN)
+
 # Инициализация бота
-bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
+bot = create_bot()
+# Хранилище состояний FSM выбирается переменной окружения FSM_STORAGE (memory, postgres, sqlite)
+storage = create_storage()
 dp = Dispatcher(storage=storage)
 
 # Состояния
@@ -74,6 +108,11 @@ class CurrencyStates(StatesGroup):
 def validate_currency(currency: str) -> bool:
     return bool(re.fullmatch(r'^[A-Za-z]{3}$', currency))
 
+# Курс из столбца NUMERIC(20, 10) приходит с хвостом нулей (90.5000000000),
+# пользователю показываем его без лишних нулей и без экспоненты
+def format_rate(rate) -> str:
+    return f"{Decimal(str(rate)).normalize():f}"
+
 # Главное меню
 async def get_inline_menu_keyboard(is_admin: bool) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
@@ -99,8 +138,7 @@ async def get_currency_management_keyboard() -> InlineKeyboardMarkup:
 async def cmd_start(message: Message):
     pool = dp["pool"]
     async with pool.acquire() as conn:
-        admin = await conn.fetchrow("SELECT * FROM admins WHERE chat_id = $1", str(message.chat.id))
-    is_admin = admin is not None
+        is_admin = await conn.is_admin(message.chat.id)
     menu = await get_inline_menu_keyboard(is_admin)
 
     if is_admin:
@@ -129,19 +167,57 @@ async def cmd_cancel(message: types.Message, state: FSMContext):
         await state.clear()
     await cmd_start(message)
 
+# Конвертация одной строкой: "/convert 250 USD" или просто "250 usd".
+# Курс и признак администратора читаются одним запросом, состояние FSM не используется
+CONVERT_PATTERN = re.compile(r"^\s*(\d+(?:[.,]\d+)?)\s+([A-Za-z]{3})\s*$")
+
+async def reply_conversion(message: Message, amount_text: str, currency: str):
+    amount = Decimal(amount_text.replace(",", "."))
+    currency = currency.upper()
+    if amount <= 0:
+        await message.answer("❌ Ошибка! Сумма должна быть положительным числом")
+        return
+
+    pool = dp["pool"]
+    async with pool.acquire() as conn:
+        rate, is_admin = await conn.conversion_rate(currency, message.chat.id)
+    menu = await get_inline_menu_keyboard(is_admin)
+
+    if rate is None:
+        await message.answer(f"❌ Валюта {currency} не найдена!", reply_markup=menu)
+        return
+
+    result = amount * rate
+    await message.answer(
+        f"Результат конвертации:\n"
+        f"{amount} {currency} = {result:.2f} RUB\n"
+        f"Курс: 1 {currency} = {format_rate(rate)} RUB",
+        reply_markup=menu
+    )
+
+@dp.message(Command("convert"))
+async def cmd_convert(message: Message, command: CommandObject):
+    match = CONVERT_PATTERN.match(command.args or "")
+    if not match:
+        await message.answer("Использование: /convert 250 USD")
+        return
+    await reply_conversion(message, match.group(1), match.group(2))
+
+@dp.message(StateFilter(None), F.text.regexp(CONVERT_PATTERN).as_("match"))
+async def process_one_line_convert(message: Message, match: re.Match):
+    await reply_conversion(message, match.group(1), match.group(2))
+
 # Получение курсов валют
 @dp.callback_query(F.data == "get_currencies")
 async def cb_get_currencies(callback: CallbackQuery):
     pool = dp["pool"]
     async with pool.acquire() as conn:
-        currencies = await conn.fetch("SELECT currency_name, rate FROM currencies ORDER BY currency_name")
-        admin = await conn.fetchrow("SELECT * FROM admins WHERE chat_id = $1", str(callback.message.chat.id))
-    is_admin = admin is not None
+        currencies, is_admin = await conn.list_currencies(callback.message.chat.id)
     menu = await get_inline_menu_keyboard(is_admin)
 
     if currencies:
         response = "Текущие курсы валют к рублю:\n" + "\n".join(
-            f"- {currency['currency_name']}: {currency['rate']} RUB"
+            f"- {currency['currency_name']}: {format_rate(currency['rate'])} RUB"
             for currency in currencies
         )
     else:
@@ -155,7 +231,7 @@ async def cb_get_currencies(callback: CallbackQuery):
 async def cb_convert(callback: CallbackQuery, state: FSMContext):
     pool = dp["pool"]
     async with pool.acquire() as conn:
-        currencies = await conn.fetch("SELECT currency_name FROM currencies")
+        currencies = await conn.currency_names()
 
     if not currencies:
         await callback.message.answer("ℹ️ В базе нет валют для конвертации")
@@ -177,13 +253,13 @@ async def process_convert_currency(message: types.Message, state: FSMContext):
         return
 
     async with pool.acquire() as conn:
-        currency_data = await conn.fetchrow("SELECT rate FROM currencies WHERE currency_name = $1", currency)
+        rate = await conn.currency_rate(currency)
 
-    if currency_data is None:
+    if rate is None:
         await message.answer(f"❌ Валюта {currency} не найдена! Попробуйте снова:")
         return
 
-    await state.update_data(currency=currency, rate=currency_data['rate'])
+    await state.update_data(currency=currency, rate=rate)
     await message.answer(f"Введите сумму в {currency} для конвертации в RUB:")
     await state.set_state(CurrencyStates.waiting_convert_amount)
 
@@ -203,14 +279,13 @@ async def process_convert_amount(message: types.Message, state: FSMContext):
         await state.clear()
 
         async with pool.acquire() as conn:
-            admin = await conn.fetchrow("SELECT * FROM admins WHERE chat_id = $1", str(message.chat.id))
-        is_admin = admin is not None
+            is_admin = await conn.is_admin(message.chat.id)
         menu = await get_inline_menu_keyboard(is_admin)
 
         await message.answer(
             f"Результат конвертации:\n"
             f"{amount} {currency} = {result:.2f} RUB\n"
-            f"Курс: 1 {currency} = {rate} RUB",
+            f"Курс: 1 {currency} = {format_rate(rate)} RUB",
             reply_markup=menu
         )
     except ValueError:
@@ -220,23 +295,22 @@ async def process_convert_amount(message: types.Message, state: FSMContext):
 @dp.message(lambda message: message.text == ADMIN_COMMAND)
 async def become_admin(message: Message):
     pool = dp["pool"]
-    chat_id = str(message.chat.id)
+    chat_id = message.chat.id
     async with pool.acquire() as conn:
-        exists = await conn.fetchval("SELECT 1 FROM admins WHERE chat_id = $1", chat_id)
-        if not exists:
-            await conn.execute("INSERT INTO admins (chat_id) VALUES ($1)", chat_id)
-            await message.answer("✅ Вы стали администратором!")
-        else:
-            await message.answer("ℹ️ Вы уже являетесь администратором.")
+        added = await conn.add_admin(chat_id)
+    if added:
+        await message.answer("✅ Вы стали администратором!")
+    else:
+        await message.answer("ℹ️ Вы уже являетесь администратором.")
     await cmd_start(message)
 
 # Выход из админки
 @dp.callback_query(F.data == "back_to_main")
 async def cb_back_to_main(callback: CallbackQuery):
     pool = dp["pool"]
-    chat_id = str(callback.message.chat.id)
+    chat_id = callback.message.chat.id
     async with pool.acquire() as conn:
-        await conn.execute("DELETE FROM admins WHERE chat_id = $1", chat_id)
+        await conn.remove_admin(chat_id)
     menu = await get_inline_menu_keyboard(False)
     await callback.message.edit_text("📋 Вы вышли из админки.", reply_markup=menu)
     await callback.answer()
@@ -259,7 +333,7 @@ async def process_currency_name(message: types.Message, state: FSMContext):
 
     pool = dp["pool"]
     async with pool.acquire() as conn:
-        exists = await conn.fetchval("SELECT 1 FROM currencies WHERE currency_name = $1", currency)
+        exists = await conn.currency_exists(currency)
     if exists:
         await message.answer(f"❌ Валюта {currency} уже существует. Введите другой код:")
         return
@@ -283,12 +357,14 @@ async def process_currency_rate(message: types.Message, state: FSMContext):
     currency_name = data['currency_name']
     pool = dp["pool"]
     async with pool.acquire() as conn:
-        await conn.execute("INSERT INTO currencies (currency_name, rate) VALUES ($1, $2)", currency_name, rate)
-        admin = await conn.fetchrow("SELECT * FROM admins WHERE chat_id = $1", str(message.chat.id))
-    is_admin = admin is not None
+        changed, is_admin = await conn.add_currency(currency_name, rate, message.chat.id)
     menu = await get_inline_menu_keyboard(is_admin)
 
-    await message.answer(f"✅ Валюта {currency_name} добавлена с курсом {rate} RUB.", reply_markup=menu)
+    # Валюту могли добавить, пока вводился курс
+    if changed:
+        await message.answer(f"✅ Валюта {currency_name} добавлена с курсом {rate} RUB.", reply_markup=menu)
+    else:
+        await message.answer(f"❌ Валюта {currency_name} уже существует.", reply_markup=menu)
     await state.clear()
 
 # Удаление валюты
@@ -296,7 +372,7 @@ async def process_currency_rate(message: types.Message, state: FSMContext):
 async def cb_delete_currency(callback: CallbackQuery):
     pool = dp["pool"]
     async with pool.acquire() as conn:
-        currencies = await conn.fetch("SELECT currency_name FROM currencies")
+        currencies = await conn.currency_names()
 
     if not currencies:
         await callback.message.answer("⚠️ Нет валют для удаления.")
@@ -317,12 +393,13 @@ async def cb_confirm_delete_currency(callback: CallbackQuery):
     currency_name = callback.data.split("_", 1)[1]
     pool = dp["pool"]
     async with pool.acquire() as conn:
-        await conn.execute("DELETE FROM currencies WHERE currency_name = $1", currency_name)
-        admin = await conn.fetchrow("SELECT * FROM admins WHERE chat_id = $1", str(callback.message.chat.id))
-    is_admin = admin is not None
+        changed, is_admin = await conn.delete_currency(currency_name, callback.message.chat.id)
     menu = await get_inline_menu_keyboard(is_admin)
 
-    await callback.message.edit_text(f"✅ Валюта {currency_name} удалена.", reply_markup=menu)
+    if changed:
+        await callback.message.edit_text(f"✅ Валюта {currency_name} удалена.", reply_markup=menu)
+    else:
+        await callback.message.edit_text(f"❌ Валюта {currency_name} не найдена.", reply_markup=menu)
     await callback.answer()
     
 
@@ -339,7 +416,7 @@ async def cb_manage_currency(callback: CallbackQuery):
 async def cb_change_rate(callback: CallbackQuery):
     pool = dp["pool"]
     async with pool.acquire() as conn:
-        currencies = await conn.fetch("SELECT currency_name FROM currencies")
+        currencies = await conn.currency_names()
 
     if not currencies:
         await callback.message.answer("⚠️ Нет валют для изменения.")
@@ -377,22 +454,194 @@ async def process_new_rate(message: types.Message, state: FSMContext):
     currency_name = data['currency_to_change']
     pool = dp["pool"]
     async with pool.acquire() as conn:
-        await conn.execute("UPDATE currencies SET rate = $1 WHERE currency_name = $2", rate, currency_name)
-        admin = await conn.fetchrow("SELECT * FROM admins WHERE chat_id = $1", str(message.chat.id))
-    is_admin = admin is not None
+        changed, is_admin = await conn.update_currency(currency_name, rate, message.chat.id)
     menu = await get_inline_menu_keyboard(is_admin)
 
-    await message.answer(f"✅ Курс валюты {currency_name} обновлен: {rate} RUB.", reply_markup=menu)
+    if changed:
+        await message.answer(f"✅ Курс валюты {currency_name} обновлен: {rate} RUB.", reply_markup=menu)
+    else:
+        await message.answer(f"❌ Валюта {currency_name} не найдена.", reply_markup=menu)
     await state.clear()
 
+# Режим с несколькими процессами. Основной процесс (supervisor) один обращается
+# к Bot API за обновлениями и раскладывает их по очередям обработчиков по chat_id,
+# поэтому все обновления одного чата (и его состояние FSM) попадают в один процесс.
+# У каждого обработчика свой пул соединений: всего до BOT_WORKERS * DB_POOL_MAX_SIZE соединений
+
+# Функция для определения чата обновления (для прочих обновлений - пользователь)
+def shard_key(update: dict) -> int:
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = event.get("from")
+        if user:
+            return user["id"]
+    return 0
+
+# Функция для выбора обработчика по chat_id
+def route_update(update: dict, workers: int) -> int:
+    return shard_key(update) % workers
+
+# Основной цикл обработчика: обновления из очереди процесса подаются в диспетчер
+async def worker_main(index: int, updates: multiprocessing.Queue):
+    pool = await create_db_pool()
+    dp["pool"] = pool
+    await start_storage(storage, pool)
+    stats_task = asyncio.create_task(report_pool_stats(pool, DB_STATS_INTERVAL))
+
+    # Очередь процессов блокирующая, поэтому читаем её в отдельном потоке
+    loop = asyncio.get_running_loop()
+    incoming = asyncio.Queue()
+
+    def read_updates():
+        while True:
+            raw = updates.get()
+            loop.call_soon_threadsafe(incoming.put_nowait, raw)
+            if raw is None:
+                return
+
+    threading.Thread(target=read_updates, daemon=True).start()
+    semaphore = asyncio.Semaphore(WORKER_MAX_CONCURRENCY)
+    tasks = set()
+
+    async def process_update(raw: dict):
+        try:
+            await dp.feed_raw_update(bot, raw)
+        except Exception as e:
+            logger.error(f"Worker {index}: error while processing update {raw.get('update_id')}: {str(e)}")
+        finally:
+            semaphore.release()
+
+    logger.info(f"Worker {index} started")
+    try:
+        while (raw := await incoming.get()) is not None:
+            await semaphore.acquire()
+            task = asyncio.create_task(process_update(raw))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        # Остановка: дожидаемся уже полученных обновлений
+        if tasks:
+            await asyncio.wait(set(tasks))
+    finally:
+        stats_task.cancel()
+        await storage.close()
+        await pool.close()
+        await bot.session.close()
+
+def run_worker(index: int, updates: multiprocessing.Queue):
+    asyncio.run(worker_main(index, updates))
+
+# Функция для запуска одного обработчика со своей очередью
+# (spawn: каждый процесс начинает с чистого состояния)
+def start_worker(index: int):
+    context = multiprocessing.get_context("spawn")
+    updates = context.Queue(maxsize=WORKER_QUEUE_SIZE)
+    process = context.Process(target=run_worker, args=(index, updates), name=f"bot1-worker-{index}")
+    process.start()
+    process.started_at = time.monotonic()
+    return updates, process
+
+# Функция для запуска процессов-обработчиков
+def start_workers(workers: int):
+    started = [start_worker(index) for index in range(workers)]
+    return [updates for updates, _ in started], [process for _, process in started]
+
+# Функция для перезапуска упавшего обработчика с новой очередью.
+# Обновления, оставшиеся в старой очереди, теряются - Telegram их повторно не пришлёт
+def restart_worker(queues, processes, index: int):
+    process = processes[index]
+    uptime = time.monotonic() - process.started_at
+    if uptime < WORKER_MIN_UPTIME:
+        raise RuntimeError(
+            f"Worker {index} exited with code {process.exitcode} after {uptime:.1f} s, not restarting"
+        )
+    logger.error(f"Worker {index} exited with code {process.exitcode}, restarting")
+    old_updates = queues[index]
+    # Старую очередь никто не читает: не ждём отправки её буфера при выходе
+    old_updates.cancel_join_thread()
+    old_updates.close()
+    queues[index], processes[index] = start_worker(index)
+
+# Функция для проверки, что все обработчики живы (упавшие перезапускаются)
+def check_workers(queues, processes):
+    for index, process in enumerate(processes):
+        if not process.is_alive():
+            restart_worker(queues, processes, index)
+
+# Функция для остановки обработчиков: каждый дорабатывает свою очередь и завершается
+def stop_workers(queues, processes, timeout=30):
+    for updates, process in zip(queues, processes):
+        # В очередь упавшего обработчика сигнал остановки может не поместиться
+        if process.is_alive():
+            try:
+                updates.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+
+# Передача обновления в очередь обработчика; если очередь заполнена,
+# ждём в отдельном потоке, не останавливая цикл событий. Ожидание идёт
+# короткими отрезками, чтобы заметить падение обработчика и не ждать его вечно
+async def dispatch_update(queues, processes, raw: dict):
+    index = route_update(raw, len(queues))
+    while True:
+        if not processes[index].is_alive():
+            restart_worker(queues, processes, index)
+        try:
+            queues[index].put_nowait(raw)
+            return
+        except queue.Full:
+            pass
+        try:
+            await asyncio.to_thread(queues[index].put, raw, True, 1)
+            return
+        except queue.Full:
+            continue
+
+# Основной процесс: получает обновления через long polling и раздаёт их обработчикам
+async def supervise(workers: int):
+    queues, processes = start_workers(workers)
+    logger.info(f"Started {workers} workers")
+    try:
+        await bot.delete_webhook(drop_pending_updates=True)
+        offset = None
+        while True:
+            # Упавшие обработчики перезапускаются, даже если обновлений для них нет
+            check_workers(queues, processes)
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30)
+            except Exception as e:
+                logger.error(f"Failed to get updates: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                await dispatch_update(queues, processes, update.model_dump(mode="json", exclude_none=True, by_alias=True))
+    finally:
+        await asyncio.to_thread(stop_workers, queues, processes)
+        await bot.session.close()
+
 # Запуск бота
 async def main():
     await init_db()
+    if BOT_WORKERS > 1:
+        await supervise(BOT_WORKERS)
+        return
+
     pool = await create_db_pool()
     dp["pool"] = pool
+    await start_storage(storage, pool)
+    stats_task = asyncio.create_task(report_pool_stats(pool, DB_STATS_INTERVAL))
     try:
         await dp.start_polling(bot, skip_updates=True)
     finally:
+        stats_task.cancel()
         await pool.close()
 
 if __name__ == "__main__":
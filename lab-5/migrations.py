@@ -0,0 +1,71 @@
+import logging
+
+# Версионные миграции схемы базы бота. Применённые версии записываются
+# в таблицу schema_migrations, поэтому при следующем запуске выполняются
+# только новые миграции. Одновременно запущенные процессы бота ждут друг
+# друга на advisory-блокировке и не применяют одну миграцию дважды.
+# Это единственный список миграций: бот из lab-6 работает с той же базой
+# и загружает этот файл (см. lab-6/migrations.py). Уже выпущенные миграции
+# не меняются - исправления добавляются новыми версиями в конец списка
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки на время применения миграций
+MIGRATIONS_LOCK_ID = 21250001
+
+# Список миграций: (версия, описание, SQL). Новые миграции добавляются в конец
+MIGRATIONS = [
+    (1, "create admins and currencies", '''
+        CREATE TABLE IF NOT EXISTS admins (
+            id SERIAL PRIMARY KEY,
+            chat_id VARCHAR UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS currencies (
+            id SERIAL PRIMARY KEY,
+            currency_name VARCHAR UNIQUE,
+            rate NUMERIC
+        );
+    '''),
+    # chat_id в Telegram - целое число: BIGINT компактнее строки и быстрее сравнивается
+    (2, "admins.chat_id as BIGINT", '''
+        ALTER TABLE admins ALTER COLUMN chat_id TYPE BIGINT USING chat_id::bigint;
+    '''),
+    # Явная точность курса вместо NUMERIC без ограничений
+    (3, "currencies.rate as NUMERIC(18, 6)", '''
+        ALTER TABLE currencies ALTER COLUMN rate TYPE NUMERIC(18, 6);
+    '''),
+    # Покрывающий индекс: поиск курса и список валют читаются только из индекса
+    (4, "covering index on currencies (currency_name) INCLUDE (rate)", '''
+        CREATE INDEX IF NOT EXISTS currencies_name_rate_idx ON currencies (currency_name) INCLUDE (rate);
+    '''),
+    # Шести знаков после запятой мало для курсов слабых валют к сильным:
+    # до 10 знаков в целой части и 10 после запятой
+    (5, "widen currencies.rate from NUMERIC(18, 6) to NUMERIC(20, 10)", '''
+        ALTER TABLE currencies ALTER COLUMN rate TYPE NUMERIC(20, 10);
+    '''),
+]
+
+# Функция для применения недостающих миграций (каждая - в своей транзакции)
+async def run_migrations(conn):
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_ID)
+    try:
+        await conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        ''')
+        applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+        for version, description, sql in MIGRATIONS:
+            if version in applied:
+                continue
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES ($1, $2)",
+                    version, description
+                )
+            logger.info(f"Applied migration {version}: {description}")
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
@@ -0,0 +1,199 @@
+import asyncio
+import asyncpg
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+# Слой запросов бота к PostgreSQL: каждое действие обработчика - один запрос к базе.
+# Запись или чтение валют объединены с проверкой прав администратора через CTE,
+# а все запросы подготавливаются один раз при открытии соединения пула
+
+logger = logging.getLogger(__name__)
+
+# Запросы дольше этого порога (в миллисекундах) пишутся в лог
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "100"))
+
+# Тексты запросов по именам подготовленных операторов
+QUERIES = {
+    "is_admin": "SELECT EXISTS (SELECT 1 FROM admins WHERE chat_id = $1)",
+    # Курсы валют вместе с признаком администратора; LEFT JOIN оставляет одну
+    # строку с пустой валютой, если таблица валют пуста
+    "list_currencies": '''
+        WITH admin AS (
+            SELECT EXISTS (SELECT 1 FROM admins WHERE chat_id = $1) AS is_admin
+        )
+        SELECT admin.is_admin, c.currency_name, c.rate
+        FROM admin LEFT JOIN currencies c ON true
+        ORDER BY c.currency_name
+    ''',
+    "currency_names": "SELECT currency_name FROM currencies ORDER BY currency_name",
+    "currency_rate": "SELECT rate FROM currencies WHERE currency_name = $1",
+    # Курс для конвертации одной строкой вместе с признаком администратора для меню
+    "conversion_rate": '''
+        SELECT (SELECT rate FROM currencies WHERE currency_name = $1) AS rate,
+               EXISTS (SELECT 1 FROM admins WHERE chat_id = $2) AS is_admin
+    ''',
+    "currency_exists": "SELECT EXISTS (SELECT 1 FROM currencies WHERE currency_name = $1)",
+    # Изменения валют: CTE с INSERT/UPDATE/DELETE выполняется всегда,
+    # а основной запрос возвращает число изменённых строк и признак администратора.
+    # Если валюта уже есть (или её нет при изменении и удалении), changed = 0
+    "add_currency": '''
+        WITH changed AS (
+            INSERT INTO currencies (currency_name, rate) VALUES ($1, $2)
+            ON CONFLICT (currency_name) DO NOTHING
+            RETURNING 1
+        )
+        SELECT (SELECT count(*) FROM changed) AS changed,
+               EXISTS (SELECT 1 FROM admins WHERE chat_id = $3) AS is_admin
+    ''',
+    "update_currency": '''
+        WITH changed AS (
+            UPDATE currencies SET rate = $2 WHERE currency_name = $1
+            RETURNING 1
+        )
+        SELECT (SELECT count(*) FROM changed) AS changed,
+               EXISTS (SELECT 1 FROM admins WHERE chat_id = $3) AS is_admin
+    ''',
+    "delete_currency": '''
+        WITH changed AS (
+            DELETE FROM currencies WHERE currency_name = $1
+            RETURNING 1
+        )
+        SELECT (SELECT count(*) FROM changed) AS changed,
+               EXISTS (SELECT 1 FROM admins WHERE chat_id = $2) AS is_admin
+    ''',
+    # Добавление администратора: вернёт 1, только если записи ещё не было
+    "add_admin": "INSERT INTO admins (chat_id) VALUES ($1) ON CONFLICT (chat_id) DO NOTHING RETURNING 1",
+    "remove_admin": "DELETE FROM admins WHERE chat_id = $1",
+}
+
+# Соединение пула с подготовленными операторами и методами для обработчиков бота
+class BotConnection(asyncpg.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = {}
+
+    # Подготовка всех запросов (вызывается из init пула для каждого нового соединения)
+    async def prepare_statements(self):
+        for name, query in QUERIES.items():
+            self.statements[name] = await self.prepare(query, name=f"bot_{name}")
+
+    # Выполнение подготовленного запроса с замером времени
+    async def run(self, name: str, method: str, *args):
+        start = time.perf_counter()
+        try:
+            return await getattr(self.statements[name], method)(*args)
+        finally:
+            record_query(name, time.perf_counter() - start)
+
+    async def is_admin(self, chat_id: int) -> bool:
+        return await self.run("is_admin", "fetchval", chat_id)
+
+    # Возвращает список валют (currency_name, rate) и признак администратора
+    async def list_currencies(self, chat_id: int):
+        rows = await self.run("list_currencies", "fetch", chat_id)
+        currencies = [row for row in rows if row["currency_name"] is not None]
+        return currencies, rows[0]["is_admin"]
+
+    async def currency_names(self) -> list:
+        return await self.run("currency_names", "fetch")
+
+    async def currency_rate(self, currency_name: str):
+        return await self.run("currency_rate", "fetchval", currency_name)
+
+    # Возвращает (курс или None, признак администратора)
+    async def conversion_rate(self, currency_name: str, chat_id: int):
+        row = await self.run("conversion_rate", "fetchrow", currency_name, chat_id)
+        return row["rate"], row["is_admin"]
+
+    async def currency_exists(self, currency_name: str) -> bool:
+        return await self.run("currency_exists", "fetchval", currency_name)
+
+    # Методы изменения валют возвращают (число изменённых строк, признак администратора)
+    async def add_currency(self, currency_name: str, rate, chat_id: int):
+        row = await self.run("add_currency", "fetchrow", currency_name, rate, chat_id)
+        return row["changed"], row["is_admin"]
+
+    async def update_currency(self, currency_name: str, rate, chat_id: int):
+        row = await self.run("update_currency", "fetchrow", currency_name, rate, chat_id)
+        return row["changed"], row["is_admin"]
+
+    async def delete_currency(self, currency_name: str, chat_id: int):
+        row = await self.run("delete_currency", "fetchrow", currency_name, chat_id)
+        return row["changed"], row["is_admin"]
+
+    # Возвращает True, если пользователь стал администратором только сейчас
+    async def add_admin(self, chat_id: int) -> bool:
+        return await self.run("add_admin", "fetchval", chat_id) is not None
+
+    async def remove_admin(self, chat_id: int):
+        await self.run("remove_admin", "fetch", chat_id)
+
+# Статистика за текущий интервал отчёта: ожидание соединения из пула
+# и время выполнения по именам запросов (количество, сумма, максимум)
+acquire_stats = {"count": 0, "total": 0.0, "max": 0.0, "timeouts": 0}
+query_stats = {}
+
+def record_query(name: str, elapsed: float):
+    stats = query_stats.setdefault(name, [0, 0.0, 0.0])
+    stats[0] += 1
+    stats[1] += elapsed
+    stats[2] = max(stats[2], elapsed)
+    if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        logger.warning(f"Slow query {name}: {elapsed * 1000:.1f} ms")
+
+# Пул, который замеряет время ожидания свободного соединения.
+# Остальные методы (close, get_size, ...) передаются пулу asyncpg как есть
+class InstrumentedPool:
+    def __init__(self, pool: asyncpg.Pool):
+        self.pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        start = time.perf_counter()
+        try:
+            conn = await self.pool.acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            acquire_stats["timeouts"] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            acquire_stats["count"] += 1
+            acquire_stats["total"] += waited
+            acquire_stats["max"] = max(acquire_stats["max"], waited)
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+async def init_connection(conn: BotConnection):
+    await conn.prepare_statements()
+
+# Функция для создания пула соединений с подготовленными запросами и замером ожидания
+async def create_pool(**kwargs) -> InstrumentedPool:
+    pool = await asyncpg.create_pool(connection_class=BotConnection, init=init_connection, **kwargs)
+    return InstrumentedPool(pool)
+
+# Фоновая задача, которая раз в interval секунд пишет в лог состояние пула
+# и статистику запросов за прошедший интервал, после чего обнуляет её
+async def report_pool_stats(pool: InstrumentedPool, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        size, idle = pool.get_size(), pool.get_idle_size()
+        count = acquire_stats["count"]
+        avg_wait = acquire_stats["total"] / count * 1000 if count else 0.0
+        logger.info(
+            f"DB pool: {size - idle} in use, {idle} idle, size {size}/{pool.get_max_size()}, "
+            f"{count} acquires, wait avg {avg_wait:.2f} ms, max {acquire_stats['max'] * 1000:.2f} ms, "
+            f"{acquire_stats['timeouts']} timeouts"
+        )
+        for name, (calls, total, longest) in sorted(query_stats.items()):
+            logger.info(
+                f"DB query {name}: {calls} calls, avg {total / calls * 1000:.2f} ms, max {longest * 1000:.2f} ms"
+            )
+        acquire_stats.update(count=0, total=0.0, max=0.0, timeouts=0)
+        query_stats.clear()
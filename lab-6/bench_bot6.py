@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import itertools
+import os
+import time
+from collections import defaultdict
+from aiohttp import web
+
+# Нагрузочный тест bot6: синтетические обновления подаются прямо в Dispatcher.feed_update
+# от тысяч имитируемых чатов. Bot API, data_manager и currency_manager заменены
+# локальными заглушками, а база - локальный PostgreSQL из переменных окружения DB_*.
+# Пример запуска:
+#   python bench_bot6.py --chats 2000 --concurrency 200
+# Каждый чат проходит сценарий: /start, курсы валют, конвертация (выбор валюты и сумма)
+
+parser = argparse.ArgumentParser(description="Пропускная способность и задержки обработчиков bot6")
+parser.add_argument("--chats", type=int, default=1000, help="Количество имитируемых чатов")
+parser.add_argument("--rounds", type=int, default=1, help="Сколько раз каждый чат проходит сценарий")
+parser.add_argument("--concurrency", type=int, default=100, help="Сколько чатов обрабатывается одновременно")
+parser.add_argument("--api-port", type=int, default=8081, help="Порт заглушки Bot API")
+parser.add_argument("--data-port", type=int, default=5102, help="Порт заглушки data_manager")
+parser.add_argument("--currency-port", type=int, default=5101, help="Порт заглушки currency_manager")
+args = parser.parse_args()
+
+# bot6 читает настройки при импорте, поэтому направляем его на заглушки заранее
+os.environ.setdefault("API_TOKEN", "123:abc")
+os.environ["BOT_API_URL"] = f"http://127.0.0.1:{args.api_port}"
+os.environ["DATA_MANAGER_URL"] = f"http://127.0.0.1:{args.data_port}"
+os.environ["CURRENCY_MANAGER_URL"] = f"http://127.0.0.1:{args.currency_port}"
+
+import logging
+from aiogram import BaseMiddleware, types
+import bot6
+
+# Логи обработчиков на каждое обновление только мешают замерам
+logging.getLogger().setLevel(logging.WARNING)
+
+CURRENCIES = [{"currency_name": "USD", "rate": 90.5}, {"currency_name": "EUR", "rate": 98.2}]
+
+# Функция для вычисления перцентиля по отсортированному списку
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# Время обработки по обработчикам: имя функции-обработчика -> список длительностей
+handler_latencies = defaultdict(list)
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            name = data["handler"].callback.__name__
+            handler_latencies[name].append(time.perf_counter() - start)
+
+# Заглушка Bot API: на любой метод отвечает успехом, на отправку сообщения - сообщением
+async def handle_bot_api(request: web.Request) -> web.Response:
+    method = request.match_info["method"]
+    data = await request.json() if request.content_type == "application/json" else dict(await request.post())
+    if method in ("sendMessage", "editMessageText"):
+        return web.json_response({"ok": True, "result": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": int(data.get("chat_id", 1)), "type": "private"},
+            "text": data.get("text", "")
+        }})
+    return web.json_response({"ok": True, "result": True})
+
+# Заглушка data_manager: список валют с ETag и конвертация по фиксированным курсам
+async def handle_currencies(request: web.Request) -> web.Response:
+    if request.headers.get("If-None-Match") == '"bench"':
+        return web.Response(status=304, headers={"ETag": '"bench"'})
+    return web.json_response({"currencies": CURRENCIES}, headers={"ETag": '"bench"'})
+
+async def handle_convert(request: web.Request) -> web.Response:
+    rates = {currency["currency_name"]: currency["rate"] for currency in CURRENCIES}
+    rate = rates.get(request.query.get("currency_name"))
+    if rate is None:
+        return web.json_response({"message": "Currency not found"}, status=404)
+    return web.json_response({"converted_amount": float(request.query.get("amount", 1)) * rate})
+
+# Заглушка currency_manager: все изменения валют считаются успешными
+async def handle_currency_change(request: web.Request) -> web.Response:
+    return web.json_response({"message": "ok"})
+
+async def start_server(routes, port):
+    app = web.Application()
+    app.router.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+# Функции для построения синтетических обновлений
+update_ids = itertools.count(1)
+
+def make_message(chat_id: int, text: str) -> dict:
+    return {
+        "message_id": next(update_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+        "text": text
+    }
+
+def message_update(chat_id: int, text: str) -> types.Update:
+    return types.Update.model_validate(
+        {"update_id": next(update_ids), "message": make_message(chat_id, text)},
+        context={"bot": bot6.bot}
+    )
+
+def callback_update(chat_id: int, data: str) -> types.Update:
+    return types.Update.model_validate({
+        "update_id": next(update_ids),
+        "callback_query": {
+            "id": str(next(update_ids)),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "chat_instance": str(chat_id),
+            "message": make_message(chat_id, "menu"),
+            "data": data
+        }
+    }, context={"bot": bot6.bot})
+
+# Сценарий одного чата: обновления одного чата идут строго по порядку, как в Telegram
+def chat_scenario(chat_id: int) -> list:
+    return [
+        lambda: message_update(chat_id, "/start"),
+        lambda: callback_update(chat_id, "get_currencies"),
+        lambda: callback_update(chat_id, "convert"),
+        lambda: message_update(chat_id, "USD"),
+        lambda: message_update(chat_id, "100"),
+    ]
+
+async def run_chats(chat_ids, rounds, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_chat(chat_id):
+        async with semaphore:
+            for _ in range(rounds):
+                for make_update in chat_scenario(chat_id):
+                    await bot6.dp.feed_update(bot6.bot, make_update())
+
+    await asyncio.gather(*(run_chat(chat_id) for chat_id in chat_ids))
+
+async def main():
+    runners = [
+        await start_server([web.post("/bot{token}/{method}", handle_bot_api)], args.api_port),
+        await start_server([
+            web.get("/currencies", handle_currencies),
+            web.get("/convert", handle_convert),
+        ], args.data_port),
+        await start_server([
+            web.post("/load", handle_currency_change),
+            web.post("/delete", handle_currency_change),
+            web.post("/update_currency", handle_currency_change),
+        ], args.currency_port),
+    ]
+
+    await bot6.init_db()
+    pool = await bot6.create_db_pool()
+    bot6.dp["pool"] = pool
+    await bot6.start_storage(bot6.storage, pool)
+    bot6.dp["data_client"] = bot6.create_http_client(bot6.DATA_MANAGER_URL)
+    bot6.dp["currency_client"] = bot6.create_http_client(bot6.CURRENCY_MANAGER_URL)
+    # Внутренние middleware видят выбранный обработчик в data["handler"]
+    bot6.dp.message.middleware(HandlerTimingMiddleware())
+    bot6.dp.callback_query.middleware(HandlerTimingMiddleware())
+    await bot6.dp.emit_startup(bot=bot6.bot)
+
+    try:
+        # Прогрев: соединения с базой и заглушками, снимок валют, кэши клавиатур
+        await run_chats(range(1, min(args.concurrency, args.chats) + 1), 1, args.concurrency)
+        handler_latencies.clear()
+        errors_before = bot6.update_stats["errors"]
+
+        chat_ids = range(1_000_000, 1_000_000 + args.chats)
+        started = time.perf_counter()
+        await run_chats(chat_ids, args.rounds, args.concurrency)
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot6.dp.emit_shutdown(bot=bot6.bot)
+        await bot6.storage.close()
+        await bot6.dp["data_client"].aclose()
+        await bot6.dp["currency_client"].aclose()
+        await pool.close()
+        await bot6.bot.session.close()
+        for runner in runners:
+            await runner.cleanup()
+
+    total = sum(len(latencies) for latencies in handler_latencies.values())
+    print(f"Чатов: {args.chats}, обновлений: {total}, время: {elapsed:.2f} с")
+    print(f"Пропускная способность: {total / elapsed:.1f} обновлений/с, "
+          f"ошибок: {bot6.update_stats['errors'] - errors_before}")
+    print(f"{'Обработчик':<28} {'вызовов':>8} {'p50, мс':>10} {'p95, мс':>10} {'p99, мс':>10}")
+    for name, latencies in sorted(handler_latencies.items()):
+        latencies.sort()
+        print(
+            f"{name:<28} {len(latencies):>8} {percentile(latencies, 50) * 1000:>10.2f} "
+            f"{percentile(latencies, 95) * 1000:>10.2f} {percentile(latencies, 99) * 1000:>10.2f}"
+        )
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+# Нагрузочное сравнение двух вариантов data_manager (Flask и ASGI/asyncpg).
+# Пример запуска:
+#   python data_manager.py                                   # порт 5002
+#   DATA_MANAGER_PORT=5003 python data_manager_async.py      # порт 5003
+#   python bench_data_manager.py http://localhost:5002 http://localhost:5003
+#
+# Важно: результаты по умолчанию не сравнивают одно и то же. Flask-вариант отвечает
+# на /convert и /currencies из кэша курсов в памяти процесса (база читается только
+# после NOTIFY об изменении), а асинхронный вариант на каждый запрос ходит в базу.
+# Чтобы сравнить именно обработку запросов с обращением к базе, используйте --as-of:
+# конвертация по историческому курсу в обоих сервисах выполняет запрос к
+# currency_rates_history на каждый вызов
+
+# Функция для вычисления перцентиля по отсортированному списку
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# Функция для прогона нагрузки по одному адресу
+async def run_benchmark(base_url, path, params, total_requests, concurrency):
+    latencies = []
+    errors = 0
+    counter = iter(range(total_requests))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        # Прогрев: устанавливаем соединения и заполняем кэши сервиса
+        await asyncio.gather(*(client.get(path, params=params) for _ in range(concurrency)))
+
+        async def worker():
+            nonlocal errors
+            for _ in counter:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path, params=params)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "url": base_url + path,
+        "rps": total_requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "errors": errors,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description="Сравнение пропускной способности вариантов data_manager")
+    parser.add_argument("urls", nargs="+", help="Базовые адреса сервисов, например http://localhost:5002")
+    parser.add_argument("--path", default="/convert", help="Проверяемый маршрут (/convert или /currencies)")
+    parser.add_argument("--currency", default="USD", help="Валюта для /convert")
+    parser.add_argument("--as-of", help="Момент времени (ISO 8601) для /convert: оба сервиса читают курс из базы")
+    parser.add_argument("--requests", type=int, default=5000, help="Количество запросов на один сервис")
+    parser.add_argument("--concurrency", type=int, default=50, help="Количество одновременных запросов")
+    args = parser.parse_args()
+
+    params = {"currency_name": args.currency, "amount": 100} if args.path == "/convert" else None
+    if params is not None and args.as_of:
+        params["as_of"] = args.as_of
+
+    print(f"{'URL':<45} {'RPS':>10} {'p50, мс':>10} {'p99, мс':>10} {'ср., мс':>10} {'ошибки':>8}")
+    for url in args.urls:
+        result = await run_benchmark(url, args.path, params, args.requests, args.concurrency)
+        print(
+            f"{result['url']:<45} {result['rps']:>10.1f} {result['p50_ms']:>10.2f} "
+            f"{result['p99_ms']:>10.2f} {result['mean_ms']:>10.2f} {result['errors']:>8}"
+        )
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+import argparse
+import asyncio
+import statistics
+import time
+import httpx
+
+# Сравнение задержки запроса к микросервису: новый httpx.AsyncClient на каждый запрос
+# (как раньше делали обработчики bot6) против одного долгоживущего клиента.
+# Пример запуска (data_manager должен быть запущен):
+#   python bench_http_client.py --url http://localhost:5002 --path /currencies
+
+# Функция для вычисления перцентиля по отсортированному списку
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# Новый клиент на каждый запрос: каждый раз устанавливается TCP-соединение
+async def measure_fresh_client(url, path, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        async with httpx.AsyncClient() as client:
+            await client.get(url + path)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+# Один общий клиент: соединение остаётся открытым между запросами
+async def measure_shared_client(url, path, requests):
+    latencies = []
+    async with httpx.AsyncClient(base_url=url) as client:
+        await client.get(path)  # прогрев соединения
+        for _ in range(requests):
+            start = time.perf_counter()
+            await client.get(path)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    mean = statistics.mean(latencies) * 1000
+    print(
+        f"{name:<22} ср. {mean:8.2f} мс   p50 {percentile(latencies, 50) * 1000:8.2f} мс   "
+        f"p99 {percentile(latencies, 99) * 1000:8.2f} мс"
+    )
+    return mean
+
+async def main():
+    parser = argparse.ArgumentParser(description="Задержка запросов с общим и одноразовым HTTP-клиентом")
+    parser.add_argument("--url", default="http://localhost:5002", help="Базовый адрес микросервиса")
+    parser.add_argument("--path", default="/currencies", help="Проверяемый маршрут")
+    parser.add_argument("--requests", type=int, default=500, help="Количество запросов в каждом режиме")
+    args = parser.parse_args()
+
+    fresh = report("Новый клиент", await measure_fresh_client(args.url, args.path, args.requests))
+    shared = report("Общий клиент", await measure_shared_client(args.url, args.path, args.requests))
+    print(f"Экономия на запрос: {fresh - shared:.2f} мс ({(1 - shared / fresh) * 100:.0f}%)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,15 +3,26 @@ import asyncpg
 import re
 import logging
 import os
+import random
+import signal
+import time
 import httpx
-from aiogram import Bot, Dispatcher, types, F
+from collections import OrderedDict
+from aiohttp import web
+from aiogram import Bot, Dispatcher, BaseMiddleware, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
+from aiogram.types import (
+    Message, CallbackQuery, InlineKeyboardMarkup, InlineQuery,
+    InlineQueryResultArticle, InputTextMessageContent
+)
 from dotenv import load_dotenv
+from fsm_storage import create_storage, start_storage
+from migrations import run_migrations
 
 # Настройка логгера
 logging.basicConfig(
@@ -24,6 +35,27 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 API_TOKEN = os.getenv("API_TOKEN")
 ADMIN_COMMAND = os.getenv("ADMIN_COMMAND")
+# Адрес Bot API (например, локальный сервер или заглушка для тестов); по умолчанию - api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL")
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Параметры webhook-сервера
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # внешний адрес, на который Telegram шлёт обновления
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Сколько обновлений обрабатывается одновременно, остальные ждут свободного места
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "100"))
+# Сколько секунд при остановке ждать завершения уже принятых обновлений
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+# Отдельный адрес для /stats: наружу открыт только WEBHOOK_PATH, статистика
+# по умолчанию доступна лишь с локальной машины. STATS_PORT=0 отключает /stats
+STATS_HOST = os.getenv("STATS_HOST", "127.0.0.1")
+STATS_PORT = int(os.getenv("STATS_PORT", "8090"))
+# Как часто писать в лог статистику обработки обновлений (в секундах)
+STATS_LOG_INTERVAL = float(os.getenv("STATS_LOG_INTERVAL", "60"))
 
 # Параметры подключения к PostgreSQL
 DB_CONFIG = {
@@ -40,31 +72,211 @@ async def create_db_pool():
 async def init_db():
     conn = await asyncpg.connect(**DB_CONFIG)
     try:
-        await conn.execute('''
-        CREATE TABLE IF NOT EXISTS admins (
-            id SERIAL PRIMARY KEY,
-            chat_id VARCHAR UNIQUE
-        )
-        ''')
-        await conn.execute('''
-        CREATE TABLE IF NOT EXISTS currencies (
-            id SERIAL PRIMARY KEY,
-            currency_name VARCHAR UNIQUE,
-            rate NUMERIC
-        )
-        ''')
+        # Схема создаётся и обновляется версионными миграциями (см. migrations.py)
+        await run_migrations(conn)
     finally:
         await conn.close()
 
 # URL микросервисов
-CURRENCY_MANAGER_URL = "http://localhost:5001"
-DATA_MANAGER_URL = "http://localhost:5002"
+CURRENCY_MANAGER_URL = os.getenv("CURRENCY_MANAGER_URL", "http://localhost:5001")
+DATA_MANAGER_URL = os.getenv("DATA_MANAGER_URL", "http://localhost:5002")
+
+# Параметры HTTP-клиентов для обращения к микросервисам
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "2"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "5"))
+
+# Долгоживущий HTTP-клиент для одного микросервиса: соединения переиспользуются между запросами
+def create_http_client(base_url: str) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    )
+
+# Параметры отказоустойчивости обращений к микросервисам
+SERVICE_CALL_DEADLINE = float(os.getenv("SERVICE_CALL_DEADLINE", "3"))  # общий срок на вызов вместе с повторами
+SERVICE_GET_RETRIES = int(os.getenv("SERVICE_GET_RETRIES", "2"))  # повторы только для GET (они идемпотентны)
+SERVICE_RETRY_BACKOFF = float(os.getenv("SERVICE_RETRY_BACKOFF", "0.1"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "15"))
+
+# Ошибка вызова микросервиса: сервис не ответил в срок, вернул 5xx или предохранитель разомкнут
+class ServiceUnavailableError(Exception):
+    pass
+
+# Предохранитель для одного микросервиса. После BREAKER_FAILURE_THRESHOLD неудачных
+# вызовов подряд размыкается и сразу отказывает, а через BREAKER_RESET_TIMEOUT секунд
+# пропускает один пробный вызов: успех замыкает его, ошибка снова размыкает
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"  # closed, open или half_open
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            logger.info(f"Circuit breaker {self.name} is half-open, probing service")
+        if self.state == "closed" or (self.state == "half_open" and not self.probe_in_flight):
+            self.probe_in_flight = self.state == "half_open"
+            self.stats["calls"] += 1
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info(f"Circuit breaker {self.name} closed")
+        self.state = "closed"
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.stats["failures"] += 1
+        self.probe_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.stats["opened"] += 1
+                logger.warning(f"Circuit breaker {self.name} opened after {self.failures} failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures, **self.stats}
+
+# Предохранители по сервисам (ключ совпадает с именем клиента в dp: data_client, currency_client)
+breakers = {"data": CircuitBreaker("data_manager"), "currency": CircuitBreaker("currency_manager")}
+
+# Функция для получения состояния предохранителей (для /stats и лога)
+def get_breaker_states() -> dict:
+    return {breaker.name: breaker.snapshot() for breaker in breakers.values()}
+
+# Функция для вызова микросервиса с общим сроком, повторами GET с экспоненциальной
+# задержкой и случайным разбросом, и учётом результата в предохранителе сервиса.
+# Ответы 4xx возвращаются как есть - это ответ сервиса, а не его отказ
+async def call_service(service: str, method: str, path: str, **kwargs) -> httpx.Response:
+    breaker = breakers[service]
+    client = dp[f"{service}_client"]
+    if not breaker.allow():
+        raise ServiceUnavailableError(f"{breaker.name} circuit is open")
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SERVICE_CALL_DEADLINE
+    attempts = 1 + SERVICE_GET_RETRIES if method == "GET" else 1
+    error = None
+    succeeded = False
+    # Результат учитывается в finally: при любом исключении (в том числе отмене задачи)
+    # предохранитель получает отказ и не остаётся навсегда в ожидании пробного вызова
+    try:
+        for attempt in range(attempts):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                response = await asyncio.wait_for(client.request(method, path, **kwargs), remaining)
+                if response.status_code < 500:
+                    succeeded = True
+                    return response
+                error = f"status {response.status_code}"
+            except (httpx.HTTPError, asyncio.TimeoutError) as e:
+                error = type(e).__name__
+            if attempt + 1 < attempts:
+                delay = SERVICE_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+                await asyncio.sleep(min(delay, max(0.0, deadline - loop.time())))
+
+        logger.error(f"{breaker.name} {method} {path} failed: {error or 'deadline exceeded'}")
+        raise ServiceUnavailableError(f"{breaker.name} is unavailable: {error or 'deadline exceeded'}")
+    finally:
+        if succeeded:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+# Функция для создания бота (с другим адресом Bot API, если он задан)
+def create_bot() -> Bot:
+    if BOT_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL))
+        return Bot(token=API_TOKEN, session=session)
+    return Bot(token=API_TOKEN)
 
 # Инициализация бота
-bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
+bot = create_bot()
+# Хранилище состояний FSM выбирается переменной окружения FSM_STORAGE (memory, postgres, sqlite).
+# В режиме webhook порт могут слушать несколько процессов, поэтому отложенная запись
+# по умолчанию выключена: каждое изменение состояния сразу пишется в базу
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0" if BOT_MODE == "webhook" else "0.05"))
+storage = create_storage(flush_interval=FSM_FLUSH_INTERVAL)
 dp = Dispatcher(storage=storage)
 
+# Статистика обработки обновлений: количество, время обработки и задержка
+# от отправки сообщения пользователем до завершения обработки (для сравнения polling и webhook)
+update_stats = {"updates": 0, "errors": 0, "handle_seconds": 0.0, "messages": 0, "reply_delay_seconds": 0.0}
+
+class UpdateStatsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            update_stats["errors"] += 1
+            raise
+        finally:
+            update_stats["updates"] += 1
+            update_stats["handle_seconds"] += time.perf_counter() - start
+            # Время сообщения в Telegram известно с точностью до секунды
+            if event.message is not None:
+                update_stats["messages"] += 1
+                update_stats["reply_delay_seconds"] += time.time() - event.message.date.timestamp()
+
+dp.update.outer_middleware(UpdateStatsMiddleware())
+
+# Функция для получения сводной статистики обработки обновлений
+def get_update_stats() -> dict:
+    stats = dict(update_stats)
+    stats["mode"] = BOT_MODE
+    stats["breakers"] = get_breaker_states()
+    if hasattr(storage, "stats"):
+        stats["fsm_storage"] = storage.stats()
+    stats["avg_handle_ms"] = stats["handle_seconds"] / stats["updates"] * 1000 if stats["updates"] else 0.0
+    stats["avg_reply_delay_ms"] = (
+        stats["reply_delay_seconds"] / stats["messages"] * 1000 if stats["messages"] else 0.0
+    )
+    return stats
+
+# Фоновая задача, которая периодически пишет статистику в лог
+async def log_update_stats():
+    while True:
+        await asyncio.sleep(STATS_LOG_INTERVAL)
+        stats = get_update_stats()
+        logger.info(
+            f"Update stats ({stats['mode']}): {stats['updates']} updates, {stats['errors']} errors, "
+            f"avg handle {stats['avg_handle_ms']:.1f} ms, avg reply delay {stats['avg_reply_delay_ms']:.0f} ms"
+        )
+        breaker_states = ", ".join(
+            f"{name}={state['state']} (failures {state['failures']}, rejected {state['rejected']})"
+            for name, state in stats["breakers"].items()
+        )
+        logger.info(f"Circuit breakers: {breaker_states}")
+        if "fsm_storage" in stats:
+            fsm = stats["fsm_storage"]
+            logger.info(
+                f"FSM storage: {fsm['entries']} entries (~{fsm['approx_bytes']} bytes), "
+                f"evicted {fsm['evicted_idle']} idle, {fsm['evicted_overflow']} over limit"
+            )
+
 # Состояния
 class CurrencyStates(StatesGroup):
     waiting_currency_name = State()
@@ -77,34 +289,65 @@ class CurrencyStates(StatesGroup):
 def validate_currency(currency: str) -> bool:
     return bool(re.fullmatch(r'^[A-Za-z]{3}$', currency))
 
+# Кэш готовых клавиатур: разметка зависит только от признака администратора
+# и версии списка валют, поэтому собирать её заново на каждый запрос не нужно
+keyboard_cache = {}
+
 # Главное меню
 async def get_inline_menu_keyboard(is_admin: bool) -> InlineKeyboardMarkup:
+    key = ("main", is_admin)
+    if key in keyboard_cache:
+        return keyboard_cache[key]
+
     builder = InlineKeyboardBuilder()
     builder.button(text="💱 Получить курсы валют", callback_data="get_currencies")
     builder.button(text="💸 Конвертировать валюту", callback_data="convert")
     if is_admin:
         builder.button(text="🛠 Управление валютами", callback_data="manage_currency")
     builder.adjust(1)
-    return builder.as_markup()
+    keyboard_cache[key] = builder.as_markup()
+    return keyboard_cache[key]
 
 # Админ-меню
 async def get_currency_management_keyboard() -> InlineKeyboardMarkup:
+    if "manage" in keyboard_cache:
+        return keyboard_cache["manage"]
+
     builder = InlineKeyboardBuilder()
     builder.button(text="➕ Добавить валюту", callback_data="add_currency")
     builder.button(text="➖ Удалить валюту", callback_data="delete_currency")
     builder.button(text="✏️ Изменить курс", callback_data="change_rate")
     builder.button(text="🚪 Выйти из админки", callback_data="back_to_main")
     builder.adjust(2)
-    return builder.as_markup()
+    keyboard_cache["manage"] = builder.as_markup()
+    return keyboard_cache["manage"]
+
+# Клавиатура со списком валют для удаления ("delete") или изменения курса ("change").
+# Хранится одна разметка на вид клавиатуры - для текущей версии снимка валют
+def get_currency_list_keyboard(kind: str, currencies: list) -> InlineKeyboardMarkup:
+    version = currency_snapshot["version"]
+    # Список не из снимка (снимок сбросили во время запроса) - собираем без кэширования
+    cacheable = currencies is currency_snapshot["currencies"]
+    cached = keyboard_cache.get(kind)
+    if cacheable and cached and cached[0] == version:
+        return cached[1]
+
+    builder = InlineKeyboardBuilder()
+    for currency in currencies:
+        text = currency["currency_name"] if kind == "delete" else f"{currency['currency_name']} ({currency['rate']})"
+        builder.button(text=text, callback_data=f"{kind}_{currency['currency_name']}")
+    builder.button(text="Назад", callback_data="manage_currency")
+    builder.adjust(2)
+    markup = builder.as_markup()
+    if cacheable:
+        keyboard_cache[kind] = (version, markup)
+    return markup
 
 # Обработчик /start
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
-    pool = dp["pool"]
-    async with pool.acquire() as conn:
-        # Проверяем, является ли пользователь админом
-        admin = await conn.fetchrow("SELECT * FROM admins WHERE chat_id = $1", str(message.chat.id))
-    is_admin = admin is not None
+    # Проверяем, является ли пользователь админом
+    is_admin = await is_user_admin(message.chat.id)
     menu = await get_inline_menu_keyboard(is_admin)
 
     if is_admin:
@@ -125,12 +368,117 @@ async def cmd_start(message: Message):
 
     await message.answer(response, reply_markup=menu)
 
+# Кэш прав администратора: chat_id -> (is_admin, срок действия).
+# Таблицу admins меняют только become_admin и cb_back_to_main, они сразу обновляют кэш,
+# но только в своём процессе. В режиме webhook порт могут слушать несколько процессов,
+# поэтому там кэш по умолчанию выключен (TTL 0) и права читаются из базы на каждый запрос.
+# Ненулевой ADMIN_CACHE_TTL при нескольких процессах - это время, в течение которого
+# другой процесс может видеть устаревшие права
+ADMIN_CACHE_TTL = float(os.getenv("ADMIN_CACHE_TTL", "0" if BOT_MODE == "webhook" else "300"))
+ADMIN_CACHE_MAX_SIZE = int(os.getenv("ADMIN_CACHE_MAX_SIZE", "10000"))
+admin_cache = OrderedDict()
+
+# Функция для записи признака администратора в кэш (самые старые записи вытесняются)
+def set_admin_cache(chat_id: int, is_admin: bool):
+    admin_cache[chat_id] = (is_admin, time.monotonic() + ADMIN_CACHE_TTL)
+    admin_cache.move_to_end(chat_id)
+    while len(admin_cache) > ADMIN_CACHE_MAX_SIZE:
+        admin_cache.popitem(last=False)
+
 # Функция для проверки прав администратора
-async def is_user_admin(chat_id: str) -> bool:
+async def is_user_admin(chat_id: int) -> bool:
+    cached = admin_cache.get(chat_id)
+    if cached and cached[1] > time.monotonic():
+        admin_cache.move_to_end(chat_id)
+        return cached[0]
+
     pool = dp["pool"]
     async with pool.acquire() as conn:
-        admin = await conn.fetchrow("SELECT * FROM admins WHERE chat_id = $1", chat_id)
-    return admin is not None
+        admin = await conn.fetchval("SELECT 1 FROM admins WHERE chat_id = $1", chat_id)
+    is_admin = admin is not None
+    set_admin_cache(chat_id, is_admin)
+    return is_admin
+
+# Ошибка получения списка валют от data_manager
+class CurrencyServiceError(Exception):
+    pass
+
+# Снимок списка валют на стороне бота: отдаётся сразу, а по истечении
+# CURRENCIES_FRESH_TTL обновляется в фоне (stale-while-revalidate)
+CURRENCIES_FRESH_TTL = float(os.getenv("CURRENCIES_FRESH_TTL", "10"))
+currency_snapshot = {"currencies": None, "etag": None, "fetched_at": 0.0, "version": 0, "generation": 0}
+# Последний полученный список валют: сохраняется и после сброса снимка,
+# чтобы отдавать его, пока data_manager недоступен
+last_known_currencies = None
+# Текущий запрос к data_manager: одновременные промахи ждут один и тот же запрос
+currency_refresh_task = None
+
+# Функция для загрузки списка валют из data_manager
+async def fetch_currencies(generation: int) -> list:
+    global last_known_currencies
+    # Если список не менялся, data_manager ответит 304 и мы оставим текущий снимок
+    previous, etag = currency_snapshot["currencies"], currency_snapshot["etag"]
+    headers = {"If-None-Match": etag} if etag and previous is not None else {}
+    try:
+        response = await call_service("data", "GET", "/currencies", headers=headers)
+    except ServiceUnavailableError as e:
+        raise CurrencyServiceError(str(e)) from e
+    if response.status_code == 304:
+        currencies = previous
+    elif response.status_code == 200:
+        currencies = response.json().get("currencies", [])
+    else:
+        logger.error(f"Currency service error: {response.status_code} - {response.text}")
+        raise CurrencyServiceError(f"data_manager responded with {response.status_code}")
+
+    # Пока шёл запрос, снимок могли сбросить - тогда результат не сохраняем
+    if generation == currency_snapshot["generation"]:
+        if currencies != currency_snapshot["currencies"]:
+            currency_snapshot["version"] += 1
+        currency_snapshot["currencies"] = currencies
+        currency_snapshot["etag"] = response.headers.get("ETag")
+        currency_snapshot["fetched_at"] = time.monotonic()
+    last_known_currencies = currencies
+    return currencies
+
+# Функция для логирования ошибок фонового обновления
+def log_refresh_result(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Background currency refresh failed: {str(task.exception())}")
+
+# Функция для запуска обновления снимка (не более одного запроса одновременно)
+def start_currency_refresh() -> asyncio.Task:
+    global currency_refresh_task
+    if currency_refresh_task is None or currency_refresh_task.done():
+        currency_refresh_task = asyncio.create_task(fetch_currencies(currency_snapshot["generation"]))
+        currency_refresh_task.add_done_callback(log_refresh_result)
+    return currency_refresh_task
+
+# Функция для получения списка валют из снимка
+async def get_currencies() -> list:
+    currencies = currency_snapshot["currencies"]
+    if currencies is not None:
+        # Устаревший снимок отдаём сразу, а обновляем его в фоне
+        if time.monotonic() - currency_snapshot["fetched_at"] > CURRENCIES_FRESH_TTL:
+            start_currency_refresh()
+        return currencies
+    # Снимка ещё нет - ждём общий запрос (отмена одного ожидающего не отменяет запрос)
+    try:
+        return await asyncio.shield(start_currency_refresh())
+    except CurrencyServiceError:
+        # Сервис недоступен - отдаём последний известный список, если он есть
+        if last_known_currencies is None:
+            raise
+        logger.warning("Data manager is unavailable, serving last known currency list")
+        return last_known_currencies
+
+# Функция для сброса снимка после изменения валют через бота
+def invalidate_currencies():
+    global currency_refresh_task
+    currency_snapshot["currencies"] = None
+    currency_snapshot["etag"] = None
+    currency_snapshot["generation"] += 1
+    currency_refresh_task = None
 
 # Обработчик отмены состояния
 @dp.message(lambda message: message.text.lower() in ["отмена", "стоп", "cancel", "выход", "начать"])
@@ -144,31 +492,26 @@ async def cmd_cancel(message: types.Message, state: FSMContext):
 @dp.callback_query(F.data == "get_currencies")
 async def cb_get_currencies(callback: CallbackQuery):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{DATA_MANAGER_URL}/currencies")
-            
-            if response.status_code != 200:
-                logger.error(f"Currency service error: {response.status_code} - {response.text}")
-                await callback.message.answer("Ошибка при получении курсов валют")
-                return
-            
-            data = response.json()
-            currencies = data.get("currencies", [])
-
-            # проверка прав администратора
-            is_admin = await is_user_admin(str(callback.message.chat.id))
-            menu = await get_inline_menu_keyboard(is_admin)
-
-            if currencies:
-                response_text = "Текущие курсы валют к рублю:\n" + "\n".join(
-                    f"- {currency['currency_name']}: {currency['rate']} RUB"
-                    for currency in currencies
-                )
-            else:
-                response_text = "ℹ️ В базе данных нет сохраненных валют"
-            
-            await callback.message.edit_text(response_text, reply_markup=menu)
-            await callback.answer()
+        try:
+            currencies = await get_currencies()
+        except CurrencyServiceError:
+            await callback.message.answer("Ошибка при получении курсов валют")
+            return
+
+        # проверка прав администратора
+        is_admin = await is_user_admin(callback.message.chat.id)
+        menu = await get_inline_menu_keyboard(is_admin)
+
+        if currencies:
+            response_text = "Текущие курсы валют к рублю:\n" + "\n".join(
+                f"- {currency['currency_name']}: {currency['rate']} RUB"
+                for currency in currencies
+            )
+        else:
+            response_text = "ℹ️ В базе данных нет сохраненных валют"
+
+        await callback.message.edit_text(response_text, reply_markup=menu)
+        await callback.answer()
     except Exception as e:
         logger.error(f"Error in cb_get_currencies: {str(e)}")
         await callback.message.answer("Произошла ошибка")
@@ -176,12 +519,14 @@ async def cb_get_currencies(callback: CallbackQuery):
 # Конвертация валюты
 @dp.callback_query(F.data == "convert")
 async def cb_convert(callback: CallbackQuery, state: FSMContext):
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{DATA_MANAGER_URL}/currencies")
-        if response.status_code != 200 or not response.json():
-            await callback.message.answer("ℹ️ В базе нет валют для конвертации")
-            await callback.answer()
-            return
+    try:
+        currencies = await get_currencies()
+    except CurrencyServiceError:
+        currencies = []
+    if not currencies:
+        await callback.message.answer("ℹ️ В базе нет валют для конвертации")
+        await callback.answer()
+        return
 
     await callback.message.answer("💸 Введите название валюты для конвертации (например: USD):")
     await state.set_state(CurrencyStates.waiting_convert_currency)
@@ -195,13 +540,16 @@ async def process_convert_currency(message: types.Message, state: FSMContext):
         await message.answer("❌ Неверный формат валюты! Введите 3 английские буквы (например: USD):")
         return
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(f"{DATA_MANAGER_URL}/convert", params={"currency_name": currency, "amount": 1})
-        if response.status_code == 404:
-            await message.answer(f"❌ Валюта {currency} не найдена! Попробуйте снова:")
-            return
-        
-        rate = response.json()["converted_amount"]
+    try:
+        response = await call_service("data", "GET", "/convert", params={"currency_name": currency, "amount": 1})
+    except ServiceUnavailableError:
+        await message.answer("⚠️ Сервис конвертации временно недоступен, попробуйте позже")
+        return
+    if response.status_code == 404:
+        await message.answer(f"❌ Валюта {currency} не найдена! Попробуйте снова:")
+        return
+
+    rate = response.json()["converted_amount"]
 
     await state.update_data(currency=currency, rate=rate)
     await message.answer(f"Введите сумму в {currency} для конвертации в RUB:")
@@ -220,7 +568,7 @@ async def process_convert_amount(message: types.Message, state: FSMContext):
         result = amount * rate
         await state.clear()
 
-        is_admin = await is_user_admin(str(message.chat.id))
+        is_admin = await is_user_admin(message.chat.id)
         menu = await get_inline_menu_keyboard(is_admin)
 
         await message.answer(
@@ -232,10 +580,58 @@ async def process_convert_amount(message: types.Message, state: FSMContext):
     except ValueError:
         await message.answer("❌ Ошибка! Введите положительное число:")
 
+# Конвертация во встроенном режиме: "@bot 100 USD" (встроенный режим включается в BotFather).
+# Ответ считается по снимку валют без запроса к data_manager и без состояния FSM,
+# а Telegram кэширует его на INLINE_CACHE_TIME секунд
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "30"))
+INLINE_QUERY_PATTERN = re.compile(r"^\s*(\d+(?:[.,]\d+)?)\s+([A-Za-z]{3})\s*$")
+# Таблица курсов по версии снимка валют: валюта -> курс
+rate_table = {"version": None, "rates": {}}
+
+# Функция для получения таблицы курсов из списка валют (пересобирается при смене версии снимка)
+def get_rate_table(currencies: list) -> dict:
+    if currencies is not currency_snapshot["currencies"]:
+        return {currency["currency_name"]: currency["rate"] for currency in currencies}
+    if rate_table["version"] != currency_snapshot["version"]:
+        rate_table["rates"] = {currency["currency_name"]: currency["rate"] for currency in currencies}
+        rate_table["version"] = currency_snapshot["version"]
+    return rate_table["rates"]
+
+@dp.inline_query()
+async def inline_convert(inline_query: InlineQuery):
+    match = INLINE_QUERY_PATTERN.match(inline_query.query)
+    if not match:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+
+    amount = float(match.group(1).replace(",", "."))
+    currency = match.group(2).upper()
+    try:
+        currencies = await get_currencies()
+    except CurrencyServiceError:
+        # Ошибку не кэшируем, чтобы повторный запрос получил ответ
+        await inline_query.answer([], cache_time=0)
+        return
+
+    rate = get_rate_table(currencies).get(currency)
+    if rate is None:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME)
+        return
+
+    result = amount * rate
+    text = f"{amount} {currency} = {result:.2f} RUB\nКурс: 1 {currency} = {rate} RUB"
+    article = InlineQueryResultArticle(
+        id=f"{currency}:{amount}",
+        title=f"{amount} {currency} = {result:.2f} RUB",
+        description=f"Курс: 1 {currency} = {rate} RUB",
+        input_message_content=InputTextMessageContent(message_text=text)
+    )
+    await inline_query.answer([article], cache_time=INLINE_CACHE_TIME)
+
 # Управление валютами (только для админов)
 @dp.callback_query(F.data == "manage_currency")
 async def cb_manage_currency(callback: CallbackQuery):
-    if not await is_user_admin(str(callback.message.chat.id)):
+    if not await is_user_admin(callback.message.chat.id):
         await callback.answer("❌ Эта функция доступна только администраторам", show_alert=True)
         return
     
@@ -258,18 +654,15 @@ async def process_currency_name(message: types.Message, state: FSMContext):
         return
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{DATA_MANAGER_URL}/currencies")
-            if response.status_code != 200:
-                await message.answer("❌ Ошибка при получении списка валют")
-                return
-            
-            data = response.json()
-            currencies = data.get("currencies", [])
-            
-            if currency in [c["currency_name"] for c in currencies]:
-                await message.answer(f"❌ Валюта {currency} уже существует. Введите другой код:")
-                return
+        try:
+            currencies = await get_currencies()
+        except CurrencyServiceError:
+            await message.answer("❌ Ошибка при получении списка валют")
+            return
+
+        if currency in [c["currency_name"] for c in currencies]:
+            await message.answer(f"❌ Валюта {currency} уже существует. Введите другой код:")
+            return
 
         await state.update_data(currency_name=currency)
         await message.answer("Введите курс этой валюты к рублю (например: 89.50):")
@@ -291,18 +684,24 @@ async def process_currency_rate(message: types.Message, state: FSMContext):
     data = await state.get_data()
     currency_name = data['currency_name']
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{CURRENCY_MANAGER_URL}/load",
+    try:
+        response = await call_service(
+            "currency", "POST", "/load",
             json={"currency_name": currency_name, "rate": rate}
         )
-        
-        if response.status_code != 200:
-            await message.answer(f"❌ Ошибка при добавлении валюты: {response.json().get('detail', '')}")
-            await state.clear()
-            return
+    except ServiceUnavailableError:
+        await message.answer("⚠️ Сервис валют временно недоступен, попробуйте позже")
+        await state.clear()
+        return
 
-    is_admin = await is_user_admin(str(message.chat.id))
+    if response.status_code != 200:
+        await message.answer(f"❌ Ошибка при добавлении валюты: {response.json().get('detail', '')}")
+        await state.clear()
+        return
+
+    # Список валют изменился - сбрасываем снимок
+    invalidate_currencies()
+    is_admin = await is_user_admin(message.chat.id)
     menu = await get_inline_menu_keyboard(is_admin)
     await message.answer(f"✅ Валюта {currency_name} добавлена с курсом {rate} RUB.", reply_markup=menu)
     await state.clear()
@@ -311,36 +710,23 @@ async def process_currency_rate(message: types.Message, state: FSMContext):
 @dp.callback_query(F.data == "delete_currency")
 async def cb_delete_currency(callback: CallbackQuery):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{DATA_MANAGER_URL}/currencies")
-            
-            if response.status_code != 200:
-                await callback.message.answer("⚠️ Ошибка при получении списка валют")
-                await callback.answer()
-                return
-                
-            data = response.json()
-            currencies = data.get("currencies", [])
-            
-            if not currencies:
-                await callback.message.answer("⚠️ Нет валют для удаления.")
-                await callback.answer()
-                return
-
-            builder = InlineKeyboardBuilder()
-            for currency in currencies:
-                builder.button(
-                    text=currency["currency_name"], 
-                    callback_data=f"delete_{currency['currency_name']}"
-                )
-            builder.button(text="Назад", callback_data="manage_currency")
-            builder.adjust(2)
-            
-            await callback.message.edit_text(
-                "Выберите валюту для удаления:", 
-                reply_markup=builder.as_markup()
-            )
+        try:
+            currencies = await get_currencies()
+        except CurrencyServiceError:
+            await callback.message.answer("⚠️ Ошибка при получении списка валют")
             await callback.answer()
+            return
+
+        if not currencies:
+            await callback.message.answer("⚠️ Нет валют для удаления.")
+            await callback.answer()
+            return
+
+        await callback.message.edit_text(
+            "Выберите валюту для удаления:", 
+            reply_markup=get_currency_list_keyboard("delete", currencies)
+        )
+        await callback.answer()
             
     except Exception as e:
         logger.error(f"Error in cb_delete_currency: {str(e)}")
@@ -353,24 +739,21 @@ async def cb_confirm_delete_currency(callback: CallbackQuery):
     currency_name = callback.data.split("_", 1)[1]
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{CURRENCY_MANAGER_URL}/delete",
-                json={"currency_name": currency_name}
-            )
-            
-            if response.status_code != 200:
-                error_msg = response.json().get("message", "Неизвестная ошибка")
-                await callback.message.answer(f"❌ Ошибка при удалении валюты: {error_msg}")
-                await callback.answer()
-                return
+        response = await call_service(
+            "currency", "POST", "/delete",
+            json={"currency_name": currency_name}
+        )
+
+        if response.status_code != 200:
+            error_msg = response.json().get("message", "Неизвестная ошибка")
+            await callback.message.answer(f"❌ Ошибка при удалении валюты: {error_msg}")
+            await callback.answer()
+            return
 
+        # Список валют изменился - сбрасываем снимок
+        invalidate_currencies()
         # Возвращаемся в главное меню
-        pool = dp["pool"]
-        async with pool.acquire() as conn:
-            admin = await conn.fetchrow("SELECT * FROM admins WHERE chat_id = $1", str(callback.message.chat.id))
-        is_admin = admin is not None
-        
+        is_admin = await is_user_admin(callback.message.chat.id)
         menu = await get_inline_menu_keyboard(is_admin)
         await callback.message.edit_text(
             f"✅ Валюта {currency_name} успешно удалена.",
@@ -387,36 +770,23 @@ async def cb_confirm_delete_currency(callback: CallbackQuery):
 @dp.callback_query(F.data == "change_rate")
 async def cb_change_rate(callback: CallbackQuery):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{DATA_MANAGER_URL}/currencies")
-            
-            if response.status_code != 200:
-                await callback.message.answer("⚠️ Ошибка при получении списка валют")
-                await callback.answer()
-                return
-                
-            data = response.json()
-            currencies = data.get("currencies", [])
-            
-            if not currencies:
-                await callback.message.answer("⚠️ Нет валют для изменения.")
-                await callback.answer()
-                return
-
-            builder = InlineKeyboardBuilder()
-            for currency in currencies:
-                builder.button(
-                    text=f"{currency['currency_name']} ({currency['rate']})", 
-                    callback_data=f"change_{currency['currency_name']}"
-                )
-            builder.button(text="Назад", callback_data="manage_currency")
-            builder.adjust(2)
-            
-            await callback.message.edit_text(
-                "Выберите валюту для изменения курса:", 
-                reply_markup=builder.as_markup()
-            )
+        try:
+            currencies = await get_currencies()
+        except CurrencyServiceError:
+            await callback.message.answer("⚠️ Ошибка при получении списка валют")
             await callback.answer()
+            return
+
+        if not currencies:
+            await callback.message.answer("⚠️ Нет валют для изменения.")
+            await callback.answer()
+            return
+
+        await callback.message.edit_text(
+            "Выберите валюту для изменения курса:", 
+            reply_markup=get_currency_list_keyboard("change", currencies)
+        )
+        await callback.answer()
             
     except Exception as e:
         logger.error(f"Error in cb_change_rate: {str(e)}")
@@ -445,19 +815,20 @@ async def process_new_rate(message: types.Message, state: FSMContext):
     currency_name = data['currency_to_change']
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{CURRENCY_MANAGER_URL}/update_currency",
-                json={"currency_name": currency_name, "rate": rate}
-            )
-            
-            if response.status_code != 200:
-                error_msg = response.json().get("message", "Неизвестная ошибка")
-                await message.answer(f"❌ Ошибка при обновлении курса: {error_msg}")
-                await state.clear()
-                return
+        response = await call_service(
+            "currency", "POST", "/update_currency",
+            json={"currency_name": currency_name, "rate": rate}
+        )
+
+        if response.status_code != 200:
+            error_msg = response.json().get("message", "Неизвестная ошибка")
+            await message.answer(f"❌ Ошибка при обновлении курса: {error_msg}")
+            await state.clear()
+            return
 
-        is_admin = await is_user_admin(str(message.chat.id))
+        # Список валют изменился - сбрасываем снимок
+        invalidate_currencies()
+        is_admin = await is_user_admin(message.chat.id)
         menu = await get_inline_menu_keyboard(is_admin)
         await message.answer(
             f"✅ Курс валюты {currency_name} обновлен: {rate} RUB.",
@@ -473,7 +844,7 @@ async def process_new_rate(message: types.Message, state: FSMContext):
 @dp.message(lambda message: message.text == ADMIN_COMMAND)
 async def become_admin(message: Message):
     pool = dp["pool"]
-    chat_id = str(message.chat.id)
+    chat_id = message.chat.id
     async with pool.acquire() as conn:
         exists = await conn.fetchval("SELECT 1 FROM admins WHERE chat_id = $1", chat_id)
         if not exists:
@@ -481,27 +852,133 @@ async def become_admin(message: Message):
             await message.answer("✅ Вы стали администратором!")
         else:
             await message.answer("ℹ️ Вы уже являетесь администратором.")
+    set_admin_cache(chat_id, True)
     await cmd_start(message)
 
 # Выход из админки
 @dp.callback_query(F.data == "back_to_main")
 async def cb_back_to_main(callback: CallbackQuery):
     pool = dp["pool"]
-    chat_id = str(callback.message.chat.id)
+    chat_id = callback.message.chat.id
     async with pool.acquire() as conn:
         await conn.execute("DELETE FROM admins WHERE chat_id = $1", chat_id)
+    set_admin_cache(chat_id, False)
     menu = await get_inline_menu_keyboard(False)
     await callback.message.edit_text("📋 Вы вышли из админки.", reply_markup=menu)
     await callback.answer()
     
+# Webhook-сервер: принимает обновления от Telegram и обрабатывает их параллельно,
+# не более WEBHOOK_MAX_CONCURRENCY одновременно. Несколько процессов могут слушать
+# один порт (reuse_port), если FSM-хранилище общее (FSM_STORAGE=postgres или sqlite)
+# и без кэшей в памяти процесса: FSM_CACHE_TTL=0, FSM_FLUSH_INTERVAL=0 и ADMIN_CACHE_TTL=0
+# (в этом режиме они такие по умолчанию). /stats слушается отдельно (STATS_HOST:STATS_PORT)
+# и показывает статистику того процесса, который принял запрос
+async def run_webhook():
+    semaphore = asyncio.Semaphore(WEBHOOK_MAX_CONCURRENCY)
+    tasks = set()
+    draining = False
+
+    # Обработка одного обновления в фоне с освобождением места после завершения
+    async def process_update(update: types.Update):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            logger.error(f"Error while processing update {update.update_id}: {str(e)}")
+        finally:
+            semaphore.release()
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        # Во время остановки новые обновления не принимаем - Telegram пришлёт их повторно
+        if draining:
+            return web.Response(status=503)
+
+        update = types.Update.model_validate(await request.json(), context={"bot": bot})
+        # Если все места заняты, ответ Telegram задерживается - так он сбавляет темп
+        await semaphore.acquire()
+        # Остановка могла начаться, пока запрос ждал места: такое обновление уже не дождутся
+        if draining:
+            semaphore.release()
+            return web.Response(status=503)
+        task = asyncio.create_task(process_update(update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return web.Response()
+
+    async def handle_stats(request: web.Request) -> web.Response:
+        stats = get_update_stats()
+        stats["in_flight"] = len(tasks)
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=True)
+    await site.start()
+
+    # Статистика - на отдельном адресе, недоступном снаружи вместе с webhook
+    stats_runner = None
+    if STATS_PORT:
+        stats_app = web.Application()
+        stats_app.router.add_get("/stats", handle_stats)
+        stats_runner = web.AppRunner(stats_app)
+        await stats_runner.setup()
+        await web.TCPSite(stats_runner, STATS_HOST, STATS_PORT, reuse_port=True).start()
+        logger.info(f"Stats server listening on {STATS_HOST}:{STATS_PORT}/stats")
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONCURRENCY,
+            drop_pending_updates=True
+        )
+    logger.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    # Ждём сигнала остановки
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await dp.emit_startup(bot=bot)
+    try:
+        await stop.wait()
+    finally:
+        # Плавная остановка: дожидаемся уже принятых обновлений
+        draining = True
+        if tasks:
+            logger.info(f"Draining {len(tasks)} in-flight updates")
+            done, pending = await asyncio.wait(set(tasks), timeout=WEBHOOK_DRAIN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            # Отменённые обработчики должны завершиться до закрытия FSM-хранилища
+            await asyncio.gather(*pending, return_exceptions=True)
+        await runner.cleanup()
+        if stats_runner:
+            await stats_runner.cleanup()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
 # Запуск бота
 async def main():
     await init_db()
     pool = await create_db_pool()
     dp["pool"] = pool
+    await start_storage(storage, pool)
+    dp["data_client"] = create_http_client(DATA_MANAGER_URL)
+    dp["currency_client"] = create_http_client(CURRENCY_MANAGER_URL)
+    stats_task = asyncio.create_task(log_update_stats())
     try:
-        await dp.start_polling(bot, skip_updates=True)
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await dp.start_polling(bot, skip_updates=True)
     finally:
+        stats_task.cancel()
+        await dp["data_client"].aclose()
+        await dp["currency_client"].aclose()
         await pool.close()
 
 if __name__ == "__main__":
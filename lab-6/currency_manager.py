@@ -1,13 +1,20 @@
 from flask import Flask, request, jsonify
 import psycopg2
-from psycopg2 import pool
+from metrics import InstrumentedConnectionPool, init_metrics
 import logging
 import os
+import csv
+import io
+import json
+import threading
+import time
+from decimal import Decimal, InvalidOperation
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = Flask(__name__)
+init_metrics(app)
 
 # Настройка логгера
 logging.basicConfig(
@@ -16,8 +23,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Пул соединений с БД
-db_pool = psycopg2.pool.SimpleConnectionPool(
+# Пул соединений с БД (с учётом метрик выдачи соединений и времени запросов)
+db_pool = InstrumentedConnectionPool(
     minconn=1,
     maxconn=10,
     dbname=os.getenv("DB_NAME"),
@@ -35,13 +42,132 @@ def get_connection():
 def return_connection(conn):
     db_pool.putconn(conn)
 
+# Канал Postgres, через который data_manager узнаёт об изменении курсов
+NOTIFY_CHANNEL = "currencies_changed"
+
+# Функция для отправки уведомления об изменении валюты (доставляется после commit)
+def notify_currency_changed(cursor, currency_name):
+    cursor.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, currency_name))
+
 # Функция для логирования запросов
 def log_request(action, currency_name=None, rate=None):
     logger.info(f"Request: {action}, Currency: {currency_name}, Rate: {rate}")
 
+# Срок хранения ключей идемпотентности (в секундах)
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+# Как часто удалять устаревшие ключи (в секундах)
+IDEMPOTENCY_PURGE_INTERVAL = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+
+# Функция для создания служебных таблиц при старте сервиса
+def init_db():
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                idempotency_key VARCHAR PRIMARY KEY,
+                action VARCHAR NOT NULL,
+                status_code INTEGER,
+                response JSONB,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            ''')
+            # История курсов: каждая запись в currencies добавляет строку сюда
+            # (rate = NULL означает, что валюта была удалена)
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS currency_rates_history (
+                id BIGSERIAL PRIMARY KEY,
+                currency_name VARCHAR NOT NULL,
+                rate NUMERIC,
+                valid_from TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            ''')
+            cursor.execute('''
+            CREATE INDEX IF NOT EXISTS currency_rates_history_name_valid_from_idx
+            ON currency_rates_history (currency_name, valid_from)
+            ''')
+            # Валюты, появившиеся до ведения истории, получают начальную запись
+            cursor.execute('''
+            INSERT INTO currency_rates_history (currency_name, rate)
+            SELECT c.currency_name, c.rate FROM currencies c
+            WHERE NOT EXISTS (
+                SELECT 1 FROM currency_rates_history h WHERE h.currency_name = c.currency_name
+            )
+            ''')
+        conn.commit()
+    finally:
+        return_connection(conn)
+    purge_idempotency_keys()
+
+# Функция для удаления устаревших ключей, чтобы таблица оставалась маленькой
+def purge_idempotency_keys():
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < now() - %s * interval '1 second'",
+                (IDEMPOTENCY_KEY_TTL,)
+            )
+            purged = cursor.rowcount
+        conn.commit()
+        if purged:
+            logger.info(f"Purged {purged} expired idempotency keys")
+    finally:
+        return_connection(conn)
+
+# Фоновый поток, который периодически удаляет устаревшие ключи
+def purge_idempotency_keys_periodically():
+    while True:
+        time.sleep(IDEMPOTENCY_PURGE_INTERVAL)
+        try:
+            purge_idempotency_keys()
+        except psycopg2.Error as e:
+            logger.error(f"Failed to purge idempotency keys: {str(e)}")
+
+# Функция для подготовки сервиса при старте: служебные таблицы и очистка ключей
+def init_service():
+    init_db()
+    threading.Thread(
+        target=purge_idempotency_keys_periodically, name="idempotency-key-purger", daemon=True
+    ).start()
+
+# Функция для резервирования ключа идемпотентности.
+# Возвращает None, если ключ новый, иначе - сохранённый ответ (тело, код)
+def claim_idempotency_key(cursor, idempotency_key, action):
+    # Параллельный запрос с тем же ключом дождётся завершения первой транзакции.
+    # Ключ старше IDEMPOTENCY_KEY_TTL считается отсутствующим: строка занимается заново,
+    # даже если фоновая очистка её ещё не удалила
+    cursor.execute(
+        "INSERT INTO idempotency_keys (idempotency_key, action) VALUES (%s, %s) "
+        "ON CONFLICT (idempotency_key) DO UPDATE "
+        "SET action = EXCLUDED.action, status_code = NULL, response = NULL, created_at = now() "
+        "WHERE idempotency_keys.created_at < now() - %s * interval '1 second' "
+        "RETURNING idempotency_key",
+        (idempotency_key, action, IDEMPOTENCY_KEY_TTL)
+    )
+    if cursor.fetchone():
+        return None
+
+    cursor.execute(
+        "SELECT action, status_code, response FROM idempotency_keys WHERE idempotency_key = %s",
+        (idempotency_key,)
+    )
+    stored_action, status_code, response = cursor.fetchone()
+    if stored_action != action:
+        return {"message": "Idempotency-Key was already used for another operation"}, 422
+    return response, status_code
+
+# Функция для сохранения ответа под ключом идемпотентности (в той же транзакции)
+def save_idempotent_response(cursor, idempotency_key, body, status_code):
+    cursor.execute(
+        "UPDATE idempotency_keys SET status_code = %s, response = %s WHERE idempotency_key = %s",
+        (status_code, json.dumps(body), idempotency_key)
+    )
+
 # Маршрут для загрузки новой валюты
 @app.route('/load', methods=['POST'])
 def load_currency():
+    idempotency_key = request.headers.get('Idempotency-Key')
     conn = get_connection()  # Получаем соединение с БД
     try:
         data = request.get_json()  # Получаем JSON данные из запроса
@@ -51,17 +177,37 @@ def load_currency():
         log_request("LOAD", currency_name, rate)  # Логируем запрос
 
         with conn.cursor() as cursor:
-            # Проверяем, существует ли уже такая валюта
-            cursor.execute("SELECT * FROM currencies WHERE currency_name = %s", (currency_name,))
+            # Повтор запроса с тем же ключом - возвращаем сохранённый ответ
+            stored = claim_idempotency_key(cursor, idempotency_key, "LOAD") if idempotency_key else None
+            if stored:
+                conn.commit()
+                logger.info(f"Idempotent replay of LOAD: {idempotency_key}")
+                return jsonify(stored[0]), stored[1]
+
+            # Добавляем валюту, пишем историю и уведомляем data_manager одним запросом;
+            # если валюта уже существует, вставка не выполняется
+            cursor.execute('''
+                WITH inserted AS (
+                    INSERT INTO currencies (currency_name, rate) VALUES (%s, %s)
+                    ON CONFLICT (currency_name) DO NOTHING
+                    RETURNING currency_name, rate
+                ), history AS (
+                    INSERT INTO currency_rates_history (currency_name, rate)
+                    SELECT currency_name, rate FROM inserted
+                )
+                SELECT pg_notify(%s, currency_name) FROM inserted
+            ''', (currency_name, rate, NOTIFY_CHANNEL))
             if cursor.fetchone():
+                logger.info(f"Currency loaded successfully: {currency_name}")
+                body, status_code = {"message": "Currency loaded successfully"}, 200
+            else:
                 logger.warning(f"Currency already exists: {currency_name}")
-                return jsonify({"message": "Currency already exists"}), 400
+                body, status_code = {"message": "Currency already exists"}, 400
 
-            # Добавляем новую валюту в БД
-            cursor.execute("INSERT INTO currencies (currency_name, rate) VALUES (%s, %s)", (currency_name, rate))
+            if idempotency_key:
+                save_idempotent_response(cursor, idempotency_key, body, status_code)
             conn.commit()  # Подтверждаем изменения
-            logger.info(f"Currency loaded successfully: {currency_name}")
-            return jsonify({"message": "Currency loaded successfully"}), 200
+            return jsonify(body), status_code
     except Exception as e:
         conn.rollback()  # Откатываем изменения в случае ошибки
         logger.error(f"Error in load_currency: {str(e)}")
@@ -72,6 +218,7 @@ def load_currency():
 # Маршрут для обновления курса валюты
 @app.route('/update_currency', methods=['POST'])
 def update_currency():
+    idempotency_key = request.headers.get('Idempotency-Key')
     conn = get_connection()  # Получаем соединение с БД
     try:
         data = request.get_json()  # Получаем JSON данные из запроса
@@ -81,17 +228,35 @@ def update_currency():
         log_request("UPDATE", currency_name, new_rate)  # Логируем запрос
         
         with conn.cursor() as cursor:
-            # Проверяем, существует ли валюта
-            cursor.execute("SELECT * FROM currencies WHERE currency_name = %s", (currency_name,))
-            if not cursor.fetchone():
+            # Повтор запроса с тем же ключом - возвращаем сохранённый ответ
+            stored = claim_idempotency_key(cursor, idempotency_key, "UPDATE") if idempotency_key else None
+            if stored:
+                conn.commit()
+                logger.info(f"Idempotent replay of UPDATE: {idempotency_key}")
+                return jsonify(stored[0]), stored[1]
+
+            # Обновляем курс, пишем историю и уведомляем data_manager одним запросом
+            cursor.execute('''
+                WITH updated AS (
+                    UPDATE currencies SET rate = %s WHERE currency_name = %s
+                    RETURNING currency_name, rate
+                ), history AS (
+                    INSERT INTO currency_rates_history (currency_name, rate)
+                    SELECT currency_name, rate FROM updated
+                )
+                SELECT pg_notify(%s, currency_name) FROM updated
+            ''', (new_rate, currency_name, NOTIFY_CHANNEL))
+            if cursor.fetchone():
+                logger.info(f"Currency updated successfully: {currency_name}")
+                body, status_code = {"message": "Currency updated successfully"}, 200
+            else:
                 logger.warning(f"Currency not found: {currency_name}")
-                return jsonify({"message": "Currency not found"}), 404
+                body, status_code = {"message": "Currency not found"}, 404
 
-            # Обновляем курс валюты
-            cursor.execute("UPDATE currencies SET rate = %s WHERE currency_name = %s", (new_rate, currency_name))
+            if idempotency_key:
+                save_idempotent_response(cursor, idempotency_key, body, status_code)
             conn.commit()  # Подтверждаем изменения
-            logger.info(f"Currency updated successfully: {currency_name}")
-            return jsonify({"message": "Currency updated successfully"}), 200
+            return jsonify(body), status_code
     except Exception as e:
         conn.rollback()  # Откатываем изменения в случае ошибки
         logger.error(f"Error in update_currency: {str(e)}")
@@ -102,6 +267,7 @@ def update_currency():
 # Маршрут для удаления валюты
 @app.route('/delete', methods=['POST'])
 def delete_currency():
+    idempotency_key = request.headers.get('Idempotency-Key')
     conn = get_connection()  # Получаем соединение с БД
     try:
         data = request.get_json()  # Получаем JSON данные из запроса
@@ -110,17 +276,35 @@ def delete_currency():
         log_request("DELETE", currency_name)  # Логируем запрос
         
         with conn.cursor() as cursor:
-            # Проверяем, существует ли валюта
-            cursor.execute("SELECT * FROM currencies WHERE currency_name = %s", (currency_name,))
-            if not cursor.fetchone():
+            # Повтор запроса с тем же ключом - возвращаем сохранённый ответ
+            stored = claim_idempotency_key(cursor, idempotency_key, "DELETE") if idempotency_key else None
+            if stored:
+                conn.commit()
+                logger.info(f"Idempotent replay of DELETE: {idempotency_key}")
+                return jsonify(stored[0]), stored[1]
+
+            # Удаляем валюту, отмечаем удаление в истории и уведомляем data_manager одним запросом
+            cursor.execute('''
+                WITH deleted AS (
+                    DELETE FROM currencies WHERE currency_name = %s
+                    RETURNING currency_name
+                ), history AS (
+                    INSERT INTO currency_rates_history (currency_name, rate)
+                    SELECT currency_name, NULL FROM deleted
+                )
+                SELECT pg_notify(%s, currency_name) FROM deleted
+            ''', (currency_name, NOTIFY_CHANNEL))
+            if cursor.fetchone():
+                logger.info(f"Currency deleted successfully: {currency_name}")
+                body, status_code = {"message": "Currency deleted successfully"}, 200
+            else:
                 logger.warning(f"Currency not found: {currency_name}")
-                return jsonify({"message": "Currency not found"}), 404
+                body, status_code = {"message": "Currency not found"}, 404
 
-            # Удаляем валюту из БД
-            cursor.execute("DELETE FROM currencies WHERE currency_name = %s", (currency_name,))
+            if idempotency_key:
+                save_idempotent_response(cursor, idempotency_key, body, status_code)
             conn.commit()  # Подтверждаем изменения
-            logger.info(f"Currency deleted successfully: {currency_name}")
-            return jsonify({"message": "Currency deleted successfully"}), 200
+            return jsonify(body), status_code
     except Exception as e:
         conn.rollback()  # Откатываем изменения в случае ошибки
         logger.error(f"Error in delete_currency: {str(e)}")
@@ -128,5 +312,161 @@ def delete_currency():
     finally:
         return_connection(conn)  # Всегда возвращаем соединение в пул
 
+# Сколько примеров отклонённых строк возвращать в отчёте о загрузке
+BULK_REJECT_SAMPLE = 20
+
+# Столбец currencies.rate имеет тип NUMERIC(20, 10): курс округляется до 10 знаков
+# после запятой и должен быть меньше 10^10, иначе вставка упадёт для всей загрузки.
+# Курс, который при округлении становится нулём, тоже отклоняется
+RATE_SCALE = Decimal("1e-10")
+RATE_LIMIT = Decimal(10) ** 10
+
+# Файлоподобный объект для COPY: читает тело запроса построчно, проверяет строки
+# и отдаёт только корректные в формате CSV, не загружая весь файл в память
+class BulkRowReader:
+    def __init__(self, lines, fmt):
+        self.lines = lines
+        self.fmt = fmt
+        self.buffer = ""
+        self.seq = 0
+        self.line_no = 0
+        self.rejected = 0
+        self.rejects = []
+
+    # Разбор одной строки входного потока в пару (название, курс)
+    def parse_line(self, line):
+        if self.fmt == "ndjson":
+            item = json.loads(line)
+            return item.get("currency_name"), item.get("rate")
+        row = next(csv.reader([line]))
+        if len(row) != 2:
+            raise ValueError("expected 2 columns")
+        return row[0], row[1]
+
+    def reject(self, reason):
+        self.rejected += 1
+        if len(self.rejects) < BULK_REJECT_SAMPLE:
+            self.rejects.append({"line": self.line_no, "reason": reason})
+
+    # Следующая корректная строка в формате CSV для COPY
+    def next_row(self):
+        for raw in self.lines:
+            self.line_no += 1
+            line = raw.decode("utf-8", errors="replace").strip() if isinstance(raw, bytes) else raw.strip()
+            if not line:
+                continue
+            try:
+                currency_name, rate = self.parse_line(line)
+            except (ValueError, AttributeError) as e:
+                self.reject(f"Malformed line: {str(e)}")
+                continue
+            # Пропускаем заголовок CSV
+            if self.fmt == "csv" and self.line_no == 1 and currency_name == "currency_name":
+                continue
+            if not isinstance(currency_name, str) or not currency_name.strip():
+                self.reject("Missing currency_name")
+                continue
+            try:
+                rate = Decimal(str(rate))
+            except InvalidOperation:
+                self.reject("Invalid rate value")
+                continue
+            if not rate.is_finite() or rate <= 0:
+                self.reject("Invalid rate value")
+                continue
+            if rate >= RATE_LIMIT or not 0 < rate.quantize(RATE_SCALE) < RATE_LIMIT:
+                self.reject("Rate value out of range")
+                continue
+            self.seq += 1
+            out = io.StringIO()
+            csv.writer(out).writerow([self.seq, currency_name.strip().upper(), rate])
+            return out.getvalue()
+        return ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            row = self.next_row()
+            if not row:
+                break
+            self.buffer += row
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+    def readline(self):
+        return self.read(len(self.buffer)) if self.buffer else self.next_row()
+
+# Маршрут для массовой загрузки курсов (CSV "currency_name,rate" или NDJSON)
+@app.route('/load/bulk', methods=['POST'])
+def load_currencies_bulk():
+    fmt = request.args.get('format')
+    if not fmt:
+        fmt = "ndjson" if "ndjson" in (request.content_type or "") else "csv"
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"message": "Unsupported format, use csv or ndjson"}), 400
+
+    log_request("LOAD_BULK", rate=fmt)  # Логируем запрос
+
+    reader = BulkRowReader(request.stream, fmt)
+    conn = get_connection()  # Получаем соединение с БД
+    try:
+        with conn.cursor() as cursor:
+            # Промежуточная таблица живёт до конца транзакции
+            cursor.execute(
+                "CREATE TEMP TABLE currencies_staging (seq BIGINT, currency_name VARCHAR, rate NUMERIC) ON COMMIT DROP"
+            )
+            cursor.copy_expert("COPY currencies_staging (seq, currency_name, rate) FROM STDIN WITH (FORMAT csv)", reader)
+
+            # Переносим данные в currencies; при повторе валюты в файле побеждает последняя строка
+            # Изменённые строки сразу попадают в историю курсов
+            cursor.execute('''
+                WITH merged AS (
+                    INSERT INTO currencies (currency_name, rate)
+                    SELECT DISTINCT ON (currency_name) currency_name, rate
+                    FROM currencies_staging
+                    ORDER BY currency_name, seq DESC
+                    ON CONFLICT (currency_name) DO UPDATE SET rate = EXCLUDED.rate
+                    WHERE currencies.rate IS DISTINCT FROM EXCLUDED.rate
+                    RETURNING currency_name, rate, (xmax = 0) AS inserted
+                ), history AS (
+                    INSERT INTO currency_rates_history (currency_name, rate)
+                    SELECT currency_name, rate FROM merged
+                )
+                SELECT inserted FROM merged
+            ''')
+            changed = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT count(DISTINCT currency_name) FROM currencies_staging")
+            distinct = cursor.fetchone()[0]
+
+            inserted = sum(1 for row in changed if row)
+            updated = len(changed) - inserted
+            if changed:
+                notify_currency_changed(cursor, "*")
+            conn.commit()  # Подтверждаем изменения одной транзакцией
+
+        report = {
+            "received": reader.seq + reader.rejected,
+            "inserted": inserted,
+            "updated": updated,
+            "unchanged": distinct - len(changed),
+            "duplicates": reader.seq - distinct,
+            "rejected": reader.rejected,
+            "rejects": reader.rejects,
+        }
+        logger.info(f"Bulk load finished: {report['inserted']} inserted, {report['updated']} updated, "
+                    f"{report['rejected']} rejected")
+        return jsonify(report), 200
+    except Exception as e:
+        conn.rollback()  # Откатываем изменения в случае ошибки
+        logger.error(f"Error in load_currencies_bulk: {str(e)}")
+        return jsonify({"message": f"Error: {str(e)}"}), 500
+    finally:
+        return_connection(conn)  # Всегда возвращаем соединение в пул
+
 if __name__ == '__main__':
+    # С debug=True Werkzeug выполняет этот блок и в следящем за файлами процессе;
+    # поток очистки ключей нужен только процессу, который обслуживает запросы
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        init_service()
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
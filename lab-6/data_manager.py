@@ -1,13 +1,22 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import psycopg2
-from psycopg2 import pool
+from metrics import InstrumentedConnectionPool, init_metrics
+import numpy as np
 import logging
 import os
+import gzip
+import hashlib
+import json
+import select
+import threading
+import time
+from datetime import datetime
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = Flask(__name__)
+init_metrics(app)
 
 # Настройка логгера
 logging.basicConfig(
@@ -16,8 +25,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Пул соединений с БД
-db_pool = psycopg2.pool.SimpleConnectionPool(
+# Пул соединений с БД (с учётом метрик выдачи соединений и времени запросов)
+db_pool = InstrumentedConnectionPool(
     minconn=1,
     maxconn=10,
     dbname=os.getenv("DB_NAME"),
@@ -35,77 +44,600 @@ def get_db_connection():
 def close_db_connection(conn):
     db_pool.putconn(conn)
 
+# Канал Postgres, в который currency_manager сообщает об изменении таблицы currencies
+NOTIFY_CHANNEL = "currencies_changed"
+# Страховочный срок жизни кэша на случай пропущенных уведомлений (в секундах)
+RATE_CACHE_TTL = float(os.getenv("RATE_CACHE_TTL", "60"))
+
+# Кэш курсов валют в памяти процесса
+rate_cache = {}
+rate_cache_loaded_at = 0.0
+# Номер поколения кэша: увеличивается при каждом сбросе
+rate_cache_generation = 0
+# Версия содержимого кэша: увеличивается, когда меняется набор валют или курсов
+rate_cache_version = 0
+rate_cache_lock = threading.Lock()
+rate_cache_stats = {"hits": 0, "misses": 0, "reloads": 0, "invalidations": 0}
+
+# Функция для полной загрузки курсов валют в кэш
+def reload_rate_cache():
+    global rate_cache, rate_cache_loaded_at, rate_cache_version
+    with rate_cache_lock:
+        generation = rate_cache_generation
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT currency_name, rate FROM currencies")
+            rates = {row[0]: float(row[1]) for row in cursor.fetchall()}
+        conn.commit()
+    finally:
+        close_db_connection(conn)
+
+    with rate_cache_lock:
+        if rates != rate_cache:
+            rate_cache_version += 1
+        rate_cache = rates
+        # Если во время загрузки пришло уведомление, данные уже могли устареть
+        rate_cache_loaded_at = time.monotonic() if generation == rate_cache_generation else 0.0
+        rate_cache_stats["reloads"] += 1
+    logger.info(f"Rate cache loaded: {len(rates)} currencies")
+
+# Функция для сброса кэша (следующее обращение перезагрузит его из БД)
+def invalidate_rate_cache():
+    global rate_cache_loaded_at, rate_cache_generation
+    with rate_cache_lock:
+        rate_cache_loaded_at = 0.0
+        rate_cache_generation += 1
+        rate_cache_stats["invalidations"] += 1
+
+# Функция для проверки, что кэш загружен и не устарел
+def ensure_rate_cache():
+    with rate_cache_lock:
+        fresh = rate_cache_loaded_at and time.monotonic() - rate_cache_loaded_at < RATE_CACHE_TTL
+    if not fresh:
+        reload_rate_cache()
+
+# Функция для получения курсов нескольких валют: сначала из кэша,
+# все промахи догружаются из БД одним запросом
+def get_rates(currency_names):
+    global rate_cache_version
+    ensure_rate_cache()
+    rates = {}
+    missing = []
+    with rate_cache_lock:
+        generation = rate_cache_generation
+        for currency_name in set(currency_names):
+            rate = rate_cache.get(currency_name)
+            if rate is not None:
+                rates[currency_name] = rate
+            else:
+                missing.append(currency_name)
+        rate_cache_stats["hits"] += len(rates)
+        rate_cache_stats["misses"] += len(missing)
+
+    if not missing:
+        return rates
+
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT currency_name, rate FROM currencies WHERE currency_name = ANY(%s)", (missing,))
+            found = {row[0]: float(row[1]) for row in cursor.fetchall()}
+        conn.commit()
+    finally:
+        close_db_connection(conn)
+
+    with rate_cache_lock:
+        if found and generation == rate_cache_generation:
+            rate_cache.update(found)
+            rate_cache_version += 1
+    rates.update(found)
+    return rates
+
+# Функция для получения курса одной валюты (None, если валюта не найдена)
+def get_rate(currency_name):
+    return get_rates([currency_name]).get(currency_name)
+
+# Функция для разбора метки времени в формате ISO 8601 (None, если формат неверный)
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+# Функция для получения курса, действовавшего на указанный момент.
+# Запрос читает одну строку по индексу (currency_name, valid_from)
+def get_rate_as_of(currency_name, as_of):
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT rate FROM currency_rates_history WHERE currency_name = %s AND valid_from <= %s "
+                "ORDER BY valid_from DESC LIMIT 1",
+                (currency_name, as_of)
+            )
+            row = cursor.fetchone()
+        conn.commit()
+    finally:
+        close_db_connection(conn)
+
+    # Нет записи или валюта на этот момент была удалена
+    if not row or row[0] is None:
+        return None
+    return float(row[0])
+
+# Фоновый поток, который слушает уведомления об изменении курсов (LISTEN/NOTIFY)
+def listen_for_rate_changes():
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(
+                dbname=os.getenv("DB_NAME"),
+                user=os.getenv("DB_USER"),
+                password=os.getenv("DB_PASSWORD"),
+                host=os.getenv("DB_HOST"),
+                port=os.getenv("DB_PORT")
+            )
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            # Пока мы не слушали канал, уведомления могли потеряться
+            invalidate_rate_cache()
+            logger.info(f"Listening for notifications on {NOTIFY_CHANNEL}")
+
+            while True:
+                if select.select([conn], [], [], 5) == ([], [], []):
+                    continue
+                conn.poll()
+                changed = set()
+                while conn.notifies:
+                    changed.add(conn.notifies.pop(0).payload)
+                if changed:
+                    logger.info(f"Currencies changed: {', '.join(sorted(changed))}")
+                    invalidate_rate_cache()
+        except psycopg2.Error as e:
+            logger.error(f"Rate cache listener error: {str(e)}")
+            time.sleep(5)
+        finally:
+            if conn:
+                conn.close()
+
+# Функция для заполнения кэша и запуска слушателя при старте сервиса
+def init_rate_cache():
+    try:
+        reload_rate_cache()
+    except psycopg2.Error as e:
+        logger.error(f"Failed to preload rate cache: {str(e)}")
+    threading.Thread(target=listen_for_rate_changes, name="rate-cache-listener", daemon=True).start()
+
+# Размер страницы для постраничной выдачи /currencies
+CURRENCIES_PAGE_SIZE = int(os.getenv("CURRENCIES_PAGE_SIZE", "100"))
+CURRENCIES_MAX_PAGE_SIZE = int(os.getenv("CURRENCIES_MAX_PAGE_SIZE", "1000"))
+# Сколько строк за раз забирать из серверного курсора при потоковой выдаче
+CURRENCIES_STREAM_BATCH = int(os.getenv("CURRENCIES_STREAM_BATCH", "500"))
+
+# Готовый ответ для /currencies, собранный для определённой версии кэша
+currencies_response = {"version": None, "etag": None, "body": None, "gzip_body": None}
+currencies_response_lock = threading.Lock()
+
+# Функция для получения сериализованного списка валют (пересобирается только при смене версии).
+# Повторный запрос той же версии сверяет только номер версии и не трогает кэш курсов
+def get_currencies_response():
+    ensure_rate_cache()
+    with rate_cache_lock:
+        version = rate_cache_version
+    with currencies_response_lock:
+        if currencies_response["version"] == version:
+            return dict(currencies_response)
+
+    # Версия сменилась: снимок курсов берём вместе с его версией, сериализуем без блокировок
+    with rate_cache_lock:
+        version = rate_cache_version
+        items = sorted(rate_cache.items())
+    currencies = [{"currency_name": name, "rate": rate} for name, rate in items]
+    body = json.dumps({"currencies": currencies}).encode()
+    etag = hashlib.sha1(body).hexdigest()
+
+    with currencies_response_lock:
+        if currencies_response["version"] != version:
+            currencies_response.update(version=version, etag=etag, body=body, gzip_body=None)
+            logger.info(f"Serialized {len(currencies)} currencies for version {version}")
+        return dict(currencies_response)
+
+# Функция для получения сжатого тела ответа (сжимается один раз на версию)
+def get_currencies_gzip_body(cached):
+    with currencies_response_lock:
+        if currencies_response["version"] == cached["version"] and currencies_response["gzip_body"]:
+            return currencies_response["gzip_body"]
+        gzip_body = gzip.compress(cached["body"])
+        if currencies_response["version"] == cached["version"]:
+            currencies_response["gzip_body"] = gzip_body
+        return gzip_body
+
+# Все курсы в таблице currencies указаны к рублю
+BASE_CURRENCY = "RUB"
+
+# Матрица кросс-курсов: matrix[i, j] - сколько единиц валюты j стоит одна единица валюты i.
+# Пересчитывается только при смене версии кэша курсов. Валюты с нулевым или
+# отрицательным курсом в матрицу не попадают: кросс-курс с ними не определён
+# ни в одну, ни в другую сторону
+cross_rates = {"version": None, "names": [], "index": {}, "matrix": None, "body": None}
+cross_rates_lock = threading.Lock()
+
+# Функция для проверки, что курс пригоден для кросс-курсов (конечный и положительный)
+def is_valid_rate(rate):
+    return rate is not None and np.isfinite(rate) and rate > 0
+
+# Функция для получения актуальной матрицы кросс-курсов
+def get_cross_rates():
+    ensure_rate_cache()
+    with rate_cache_lock:
+        version = rate_cache_version
+        items = sorted((name, rate) for name, rate in rate_cache.items() if name != BASE_CURRENCY)
+
+    with cross_rates_lock:
+        if cross_rates["version"] != version:
+            invalid = [name for name, rate in items if not is_valid_rate(rate)]
+            if invalid:
+                logger.warning(f"Currencies excluded from cross rates (non-positive rate): {', '.join(invalid)}")
+            items = [(name, rate) for name, rate in items if is_valid_rate(rate)]
+            names = [BASE_CURRENCY] + [name for name, _ in items]
+            rates = np.array([1.0] + [rate for _, rate in items], dtype=np.float64)
+            # Кросс-курс i -> j равен rate_i / rate_j, считаем всю матрицу одним внешним произведением
+            matrix = np.outer(rates, 1.0 / rates)
+            cross_rates.update(
+                version=version,
+                names=names,
+                index={name: i for i, name in enumerate(names)},
+                matrix=matrix,
+                body=None
+            )
+            logger.info(f"Cross-rate matrix recomputed for {len(names)} currencies, version {version}")
+        return dict(cross_rates)
+
+# Функция для получения кросс-курса пары валют (None, если одной из валют нет
+# или её курс не положительный - в обе стороны одинаково)
+def get_cross_rate(currency_from, currency_to, as_of=None):
+    # Исторический кросс-курс считаем из двух курсов к рублю на нужный момент
+    if as_of:
+        rate_from = 1.0 if currency_from == BASE_CURRENCY else get_rate_as_of(currency_from, as_of)
+        rate_to = 1.0 if currency_to == BASE_CURRENCY else get_rate_as_of(currency_to, as_of)
+        if not is_valid_rate(rate_from) or not is_valid_rate(rate_to):
+            return None
+        return rate_from / rate_to
+
+    cross = get_cross_rates()
+    i = cross["index"].get(currency_from)
+    j = cross["index"].get(currency_to)
+    if i is None or j is None:
+        return None
+    return float(cross["matrix"][i, j])
+
 # Функция для логирования входящих запросов
 def log_request(action, currency_name=None, amount=None):
     logger.info(f"Request: {action}, Currency: {currency_name}, Amount: {amount}")
 
+# Функция для конвертации по кросс-курсу
+def convert_cross(currency_from, currency_to, amount, as_of):
+    log_request("CONVERT_CROSS", f"{currency_from}->{currency_to}", amount)
+    if not currency_from or not currency_to:
+        return jsonify({"message": "Both from and to are required"}), 400
+
+    try:
+        rate = get_cross_rate(currency_from, currency_to, as_of)
+    except psycopg2.Error as e:
+        # Обработка ошибок базы данных
+        logger.error(f"Database error in convert_cross: {str(e)}")
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    if rate is None:
+        logger.warning(f"Currency pair not found: {currency_from}->{currency_to}")
+        return jsonify({"message": "Currency not found"}), 404
+
+    converted_amount = amount * rate
+    logger.info(f"Cross conversion successful: {amount} {currency_from} = {converted_amount} {currency_to}")
+    return jsonify({"converted_amount": converted_amount, "rate": rate}), 200
+
 # Маршрут для конвертации валют
 @app.route('/convert', methods=['GET'])
 def convert_currency():
     # Получаем параметры из запроса
     currency_name = request.args.get('currency_name')
     amount = request.args.get('amount')
+    as_of = request.args.get('as_of')
 
     # Логируем запрос
     log_request("CONVERT", currency_name, amount)
     
+    # В режиме кросс-курса сумма необязательна: без неё возвращается курс для 1 единицы
+    if amount is None and ('from' in request.args or 'to' in request.args):
+        amount = 1
+
     # Пробуем преобразовать amount в число
     try:
         amount = float(amount)
-    except ValueError:
+    except (TypeError, ValueError):
         logger.warning(f"Invalid amount value: {amount}")
         return jsonify({"message": "Invalid amount value"}), 400
 
+    # Пробуем разобрать момент времени для конвертации по историческому курсу
+    if as_of is not None:
+        as_of = parse_timestamp(as_of)
+        if as_of is None:
+            logger.warning(f"Invalid as_of value: {request.args.get('as_of')}")
+            return jsonify({"message": "Invalid as_of value"}), 400
+
+    # Конвертация между двумя произвольными валютами (?from=USD&to=EUR)
+    if 'from' in request.args or 'to' in request.args:
+        return convert_cross(request.args.get('from'), request.args.get('to'), amount, as_of)
+
+    try:
+        # Исторический курс берём из истории, текущий - из кэша (при промахе - из базы данных)
+        rate = get_rate_as_of(currency_name, as_of) if as_of else get_rate(currency_name)
+
+        # Если валюта не найдена
+        if rate is None:
+            logger.warning(f"Currency not found: {currency_name}")
+            return jsonify({"message": "Currency not found"}), 404
+
+        # Выполняем конвертацию
+        converted_amount = amount * rate
+        logger.info(f"Conversion successful: {amount} {currency_name} = {converted_amount}")
+        return jsonify({"converted_amount": converted_amount}), 200
+    except psycopg2.Error as e:
+        # Обработка ошибок базы данных
+        logger.error(f"Database error in convert: {str(e)}")
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+# Максимальное количество точек в ответе /rates/history
+RATE_HISTORY_MAX_POINTS = int(os.getenv("RATE_HISTORY_MAX_POINTS", "10000"))
+
+# Маршрут для получения истории курса валюты за период (?currency_name=&from=&to=)
+@app.route('/rates/history', methods=['GET'])
+def get_rate_history():
+    currency_name = request.args.get('currency_name')
+    # Границы периода по умолчанию - вся история
+    date_from = parse_timestamp(request.args['from']) if 'from' in request.args else "-infinity"
+    date_to = parse_timestamp(request.args['to']) if 'to' in request.args else "infinity"
+
+    log_request("HISTORY", currency_name)
+
+    if not currency_name:
+        return jsonify({"message": "currency_name is required"}), 400
+    if date_from is None or date_to is None:
+        logger.warning(f"Invalid history range: {request.args.get('from')} - {request.args.get('to')}")
+        return jsonify({"message": "Invalid from/to values"}), 400
+
     conn = None
     try:
-        # Получаем соединение с БД
         conn = get_db_connection()
         with conn.cursor() as cursor:
-            # Ищем валюту в базе данных
-            cursor.execute("SELECT rate FROM currencies WHERE currency_name = %s", (currency_name,))
-            existing_currency = cursor.fetchone()
-
-            # Если валюта не найдена
-            if not existing_currency:
-                logger.warning(f"Currency not found: {currency_name}")
-                return jsonify({"message": "Currency not found"}), 404
-
-            # Выполняем конвертацию
-            rate = existing_currency[0]
-            converted_amount = amount * float(rate)
-            logger.info(f"Conversion successful: {amount} {currency_name} = {converted_amount}")
-            return jsonify({"converted_amount": converted_amount}), 200
+            # Первая точка - курс, действовавший на начало периода, далее - все изменения внутри периода
+            cursor.execute('''
+                SELECT valid_from, rate FROM (
+                    (SELECT valid_from, rate FROM currency_rates_history
+                     WHERE currency_name = %s AND valid_from <= %s
+                     ORDER BY valid_from DESC LIMIT 1)
+                    UNION ALL
+                    (SELECT valid_from, rate FROM currency_rates_history
+                     WHERE currency_name = %s AND valid_from > %s AND valid_from <= %s
+                     ORDER BY valid_from LIMIT %s)
+                ) AS series
+                ORDER BY valid_from
+            ''', (currency_name, date_from, currency_name, date_from, date_to, RATE_HISTORY_MAX_POINTS))
+            rows = cursor.fetchall()
+        conn.commit()
     except psycopg2.Error as e:
         # Обработка ошибок базы данных
-        logger.error(f"Database error in convert: {str(e)}")
+        logger.error(f"Database error in get_rate_history: {str(e)}")
         return jsonify({"message": f"Database error: {str(e)}"}), 500
     finally:
-        # Всегда возвращаем соединение в пул
         if conn:
             close_db_connection(conn)
 
+    rates = [
+        {"valid_from": row[0].isoformat(), "rate": float(row[1]) if row[1] is not None else None}
+        for row in rows
+    ]
+    logger.info(f"Retrieved {len(rates)} history points for {currency_name}")
+    return jsonify({"currency_name": currency_name, "rates": rates}), 200
+
+# Маршрут для пакетной конвертации: принимает массив пар {currency_name, amount}
+@app.route('/convert/batch', methods=['POST'])
+def convert_currency_batch():
+    data = request.get_json(silent=True)
+    # Допускаем как массив, так и объект вида {"items": [...]}
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        logger.warning("Invalid batch request body")
+        return jsonify({"message": "Expected a JSON array of {currency_name, amount}"}), 400
+
+    log_request("CONVERT_BATCH", amount=len(items))
+
+    try:
+        # Получаем курсы всех валют пакета за одно обращение
+        names = [item.get('currency_name') for item in items if isinstance(item, dict)]
+        rates = get_rates([name for name in names if isinstance(name, str)])
+    except psycopg2.Error as e:
+        # Обработка ошибок базы данных
+        logger.error(f"Database error in convert_batch: {str(e)}")
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    # Формируем результаты в порядке входных элементов, ошибки - для каждого элемента отдельно
+    results = []
+    for item in items:
+        if not isinstance(item, dict):
+            results.append({"error": "Invalid item"})
+            continue
+        currency_name = item.get('currency_name')
+        result = {"currency_name": currency_name, "amount": item.get('amount')}
+        try:
+            amount = float(item.get('amount'))
+        except (TypeError, ValueError):
+            result["error"] = "Invalid amount value"
+            results.append(result)
+            continue
+        rate = rates.get(currency_name) if isinstance(currency_name, str) else None
+        if rate is None:
+            result["error"] = "Currency not found"
+        else:
+            result["converted_amount"] = amount * rate
+        results.append(result)
+
+    logger.info(f"Batch conversion: {len(results)} items")
+    return jsonify({"results": results}), 200
+
 # Маршрут для получения списка всех валют
 @app.route('/currencies', methods=['GET'])
 def get_currencies():
+    # Потоковая выдача в формате NDJSON
+    if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        return stream_currencies(request.args.get('after'))
+
+    # Постраничная выдача по ключу (?after=<currency_name>&limit=N)
+    if 'after' in request.args or 'limit' in request.args:
+        return get_currencies_page(request.args.get('after'), request.args.get('limit'))
+
+    try:
+        cached = get_currencies_response()
+    except psycopg2.Error as e:
+        # Обработка ошибок базы данных
+        logger.error(f"Database error in get_currencies: {str(e)}")
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    # У сжатого и несжатого представления разные ETag.
+    # Учитываем q-значения: "gzip;q=0" означает отказ от сжатия
+    use_gzip = request.accept_encodings["gzip"] > 0
+    etag = cached["etag"] + ("-gz" if use_gzip else "")
+
+    # Клиент уже получал эту версию списка - отвечаем 304 без тела
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif use_gzip:
+        response = Response(get_currencies_gzip_body(cached), status=200, mimetype='application/json')
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(cached["body"], status=200, mimetype='application/json')
+
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# Функция для постраничной выдачи валют по ключу currency_name
+def get_currencies_page(after, limit):
+    try:
+        limit = int(limit) if limit is not None else CURRENCIES_PAGE_SIZE
+    except ValueError:
+        logger.warning(f"Invalid limit value: {limit}")
+        return jsonify({"message": "Invalid limit value"}), 400
+    if limit <= 0:
+        return jsonify({"message": "Invalid limit value"}), 400
+    limit = min(limit, CURRENCIES_MAX_PAGE_SIZE)
+
     conn = None
     try:
-        # Получаем соединение с БД
         conn = get_db_connection()
         with conn.cursor() as cursor:
-            # Получаем список всех валют из базы
-            cursor.execute("SELECT currency_name, rate FROM currencies ORDER BY currency_name")
-            # Формируем список словарей с валютами и курсами
-            currencies = [{"currency_name": row[0], "rate": float(row[1])} for row in cursor.fetchall()]
-            logger.info(f"Retrieved {len(currencies)} currencies")
-            return jsonify({"currencies": currencies}), 200
+            # Забираем на одну строку больше, чтобы понять, есть ли следующая страница
+            if after:
+                cursor.execute(
+                    "SELECT currency_name, rate FROM currencies WHERE currency_name > %s ORDER BY currency_name LIMIT %s",
+                    (after, limit + 1)
+                )
+            else:
+                cursor.execute("SELECT currency_name, rate FROM currencies ORDER BY currency_name LIMIT %s", (limit + 1,))
+            rows = cursor.fetchall()
+        conn.commit()
     except psycopg2.Error as e:
         # Обработка ошибок базы данных
-        logger.error(f"Database error in get_currencies: {str(e)}")
+        logger.error(f"Database error in get_currencies_page: {str(e)}")
         return jsonify({"message": f"Database error: {str(e)}"}), 500
     finally:
-        # Всегда возвращаем соединение в пул
         if conn:
             close_db_connection(conn)
 
+    currencies = [{"currency_name": row[0], "rate": float(row[1])} for row in rows[:limit]]
+    next_after = currencies[-1]["currency_name"] if len(rows) > limit else None
+    logger.info(f"Retrieved page of {len(currencies)} currencies after {after}")
+    return jsonify({"currencies": currencies, "next_after": next_after}), 200
+
+# Функция для потоковой выдачи валют: строки читаются из серверного курсора
+# порциями и сразу отправляются клиенту, весь список в памяти не собирается
+def stream_currencies(after):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(name="currencies_stream")
+        cursor.itersize = CURRENCIES_STREAM_BATCH
+        if after:
+            cursor.execute(
+                "SELECT currency_name, rate FROM currencies WHERE currency_name > %s ORDER BY currency_name",
+                (after,)
+            )
+        else:
+            cursor.execute("SELECT currency_name, rate FROM currencies ORDER BY currency_name")
+    except psycopg2.Error as e:
+        close_db_connection(conn)
+        logger.error(f"Database error in stream_currencies: {str(e)}")
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    def generate():
+        count = 0
+        try:
+            for row in cursor:
+                count += 1
+                yield json.dumps({"currency_name": row[0], "rate": float(row[1])}) + "\n"
+            cursor.close()
+            conn.commit()
+            logger.info(f"Streamed {count} currencies")
+        except psycopg2.Error as e:
+            # Заголовки уже отправлены, поэтому ошибку можно только залогировать
+            logger.error(f"Database error while streaming currencies: {str(e)}")
+        finally:
+            # Незавершённую транзакцию пул откатит сам
+            close_db_connection(conn)
+
+    return Response(generate(), status=200, mimetype='application/x-ndjson')
+
+# Маршрут для получения полной матрицы кросс-курсов
+@app.route('/matrix', methods=['GET'])
+def get_matrix():
+    try:
+        cross = get_cross_rates()
+    except psycopg2.Error as e:
+        # Обработка ошибок базы данных
+        logger.error(f"Database error in get_matrix: {str(e)}")
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    # Сериализуем матрицу один раз на версию курсов
+    body = cross["body"]
+    if body is None:
+        body = json.dumps({
+            "base": BASE_CURRENCY,
+            "currencies": cross["names"],
+            "matrix": cross["matrix"].tolist(),
+        }).encode()
+        with cross_rates_lock:
+            if cross_rates["version"] == cross["version"]:
+                cross_rates["body"] = body
+    return Response(body, status=200, mimetype='application/json')
+
+# Маршрут для получения статистики кэша курсов
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    with rate_cache_lock:
+        stats = dict(rate_cache_stats)
+        stats["size"] = len(rate_cache)
+        stats["generation"] = rate_cache_generation
+        stats["version"] = rate_cache_version
+        stats["age_seconds"] = time.monotonic() - rate_cache_loaded_at if rate_cache_loaded_at else None
+    stats["ttl_seconds"] = RATE_CACHE_TTL
+    return jsonify(stats), 200
+
 if __name__ == '__main__':
+    # С debug=True Werkzeug выполняет этот блок дважды: в следящем за файлами процессе
+    # и в дочернем, который обслуживает запросы (WERKZEUG_RUN_MAIN=true). Кэш курсов
+    # и соединение LISTEN нужны только второму
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        init_rate_cache()
     app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
@@ -0,0 +1,281 @@
+from quart import Quart, request, jsonify, Response
+import asyncpg
+import logging
+import os
+import gzip
+import hashlib
+import json
+import math
+from datetime import datetime
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Асинхронный вариант data_manager: тот же контракт /convert и /currencies
+# (as_of, from/to, постраничная и потоковая выдача, ETag), но запросы обслуживаются
+# ASGI-сервером поверх пула asyncpg. Кэша курсов в памяти здесь нет: каждый запрос
+# читает базу. При изменении контракта в data_manager.py его нужно повторить и здесь
+app = Quart(__name__)
+
+# Настройка логгера
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Параметры подключения к PostgreSQL
+DB_CONFIG = {
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT"),
+    "database": os.getenv("DB_NAME"),
+}
+
+# Размеры пула соединений
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+
+# Размер страницы для постраничной выдачи /currencies (как в data_manager.py)
+CURRENCIES_PAGE_SIZE = int(os.getenv("CURRENCIES_PAGE_SIZE", "100"))
+CURRENCIES_MAX_PAGE_SIZE = int(os.getenv("CURRENCIES_MAX_PAGE_SIZE", "1000"))
+# Сколько строк за раз забирать из курсора при потоковой выдаче
+CURRENCIES_STREAM_BATCH = int(os.getenv("CURRENCIES_STREAM_BATCH", "500"))
+
+# Все курсы в таблице currencies указаны к рублю
+BASE_CURRENCY = "RUB"
+
+# Создаём пул соединений при старте сервера
+@app.before_serving
+async def create_db_pool():
+    app.db_pool = await asyncpg.create_pool(
+        **DB_CONFIG,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE
+    )
+
+# Закрываем пул при остановке сервера
+@app.after_serving
+async def close_db_pool():
+    await app.db_pool.close()
+
+# Функция для логирования входящих запросов
+def log_request(action, currency_name=None, amount=None):
+    logger.info(f"Request: {action}, Currency: {currency_name}, Amount: {amount}")
+
+# Функция для разбора метки времени в формате ISO 8601 (None, если формат неверный)
+def parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+# Функция для получения текущего курса или курса на указанный момент (из истории)
+async def fetch_rate(conn, currency_name, as_of=None):
+    if as_of:
+        rate = await conn.fetchval(
+            "SELECT rate FROM currency_rates_history WHERE currency_name = $1 AND valid_from <= $2 "
+            "ORDER BY valid_from DESC LIMIT 1",
+            currency_name, as_of
+        )
+    else:
+        rate = await conn.fetchval("SELECT rate FROM currencies WHERE currency_name = $1", currency_name)
+    return float(rate) if rate is not None else None
+
+# Функция для проверки, что курс пригоден для кросс-курсов (конечный и положительный)
+def is_valid_rate(rate):
+    return rate is not None and math.isfinite(rate) and rate > 0
+
+# Функция для получения кросс-курса пары валют (None, если одной из валют нет
+# или её курс не положительный - такая валюта не участвует в кросс-курсах)
+async def fetch_cross_rate(currency_from, currency_to, as_of=None):
+    async with app.db_pool.acquire() as conn:
+        rate_from = 1.0 if currency_from == BASE_CURRENCY else await fetch_rate(conn, currency_from, as_of)
+        rate_to = 1.0 if currency_to == BASE_CURRENCY else await fetch_rate(conn, currency_to, as_of)
+    if not is_valid_rate(rate_from) or not is_valid_rate(rate_to):
+        return None
+    return rate_from / rate_to
+
+# Функция для конвертации по кросс-курсу
+async def convert_cross(currency_from, currency_to, amount, as_of):
+    log_request("CONVERT_CROSS", f"{currency_from}->{currency_to}", amount)
+    if not currency_from or not currency_to:
+        return jsonify({"message": "Both from and to are required"}), 400
+
+    try:
+        rate = await fetch_cross_rate(currency_from, currency_to, as_of)
+    except asyncpg.PostgresError as e:
+        # Обработка ошибок базы данных
+        logger.error(f"Database error in convert_cross: {str(e)}")
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    if rate is None:
+        logger.warning(f"Currency pair not found: {currency_from}->{currency_to}")
+        return jsonify({"message": "Currency not found"}), 404
+
+    converted_amount = amount * rate
+    logger.info(f"Cross conversion successful: {amount} {currency_from} = {converted_amount} {currency_to}")
+    return jsonify({"converted_amount": converted_amount, "rate": rate}), 200
+
+# Маршрут для конвертации валют
+@app.route('/convert', methods=['GET'])
+async def convert_currency():
+    # Получаем параметры из запроса
+    currency_name = request.args.get('currency_name')
+    amount = request.args.get('amount')
+    as_of = request.args.get('as_of')
+
+    # Логируем запрос
+    log_request("CONVERT", currency_name, amount)
+
+    # В режиме кросс-курса сумма необязательна: без неё возвращается курс для 1 единицы
+    if amount is None and ('from' in request.args or 'to' in request.args):
+        amount = 1
+
+    # Пробуем преобразовать amount в число
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        logger.warning(f"Invalid amount value: {amount}")
+        return jsonify({"message": "Invalid amount value"}), 400
+
+    # Пробуем разобрать момент времени для конвертации по историческому курсу
+    if as_of is not None:
+        as_of = parse_timestamp(as_of)
+        if as_of is None:
+            logger.warning(f"Invalid as_of value: {request.args.get('as_of')}")
+            return jsonify({"message": "Invalid as_of value"}), 400
+
+    # Конвертация между двумя произвольными валютами (?from=USD&to=EUR)
+    if 'from' in request.args or 'to' in request.args:
+        return await convert_cross(request.args.get('from'), request.args.get('to'), amount, as_of)
+
+    try:
+        # Ищем курс валюты (текущий или на момент as_of)
+        async with app.db_pool.acquire() as conn:
+            rate = await fetch_rate(conn, currency_name, as_of)
+    except asyncpg.PostgresError as e:
+        # Обработка ошибок базы данных
+        logger.error(f"Database error in convert: {str(e)}")
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    # Если валюта не найдена
+    if rate is None:
+        logger.warning(f"Currency not found: {currency_name}")
+        return jsonify({"message": "Currency not found"}), 404
+
+    # Выполняем конвертацию
+    converted_amount = amount * rate
+    logger.info(f"Conversion successful: {amount} {currency_name} = {converted_amount}")
+    return jsonify({"converted_amount": converted_amount}), 200
+
+# Маршрут для получения списка всех валют
+@app.route('/currencies', methods=['GET'])
+async def get_currencies():
+    # Потоковая выдача в формате NDJSON
+    if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        return stream_currencies(request.args.get('after'))
+
+    # Постраничная выдача по ключу (?after=<currency_name>&limit=N)
+    if 'after' in request.args or 'limit' in request.args:
+        return await get_currencies_page(request.args.get('after'), request.args.get('limit'))
+
+    try:
+        rows = await app.db_pool.fetch("SELECT currency_name, rate FROM currencies ORDER BY currency_name")
+    except asyncpg.PostgresError as e:
+        # Обработка ошибок базы данных
+        logger.error(f"Database error in get_currencies: {str(e)}")
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    # Тело сериализуется так же, как в data_manager.py, поэтому ETag у сервисов совпадает
+    currencies = [{"currency_name": row["currency_name"], "rate": float(row["rate"])} for row in rows]
+    body = json.dumps({"currencies": currencies}).encode()
+    # Учитываем q-значения: "gzip;q=0" означает отказ от сжатия
+    use_gzip = request.accept_encodings["gzip"] > 0
+    etag = hashlib.sha1(body).hexdigest() + ("-gz" if use_gzip else "")
+
+    # Клиент уже получал эту версию списка - отвечаем 304 без тела
+    if request.if_none_match.contains(etag):
+        response = Response(b"", status=304)
+    elif use_gzip:
+        response = Response(gzip.compress(body), status=200, mimetype='application/json')
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(body, status=200, mimetype='application/json')
+
+    logger.info(f"Retrieved {len(currencies)} currencies")
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# Функция для постраничной выдачи валют по ключу currency_name
+async def get_currencies_page(after, limit):
+    try:
+        limit = int(limit) if limit is not None else CURRENCIES_PAGE_SIZE
+    except ValueError:
+        logger.warning(f"Invalid limit value: {limit}")
+        return jsonify({"message": "Invalid limit value"}), 400
+    if limit <= 0:
+        return jsonify({"message": "Invalid limit value"}), 400
+    limit = min(limit, CURRENCIES_MAX_PAGE_SIZE)
+
+    try:
+        # Забираем на одну строку больше, чтобы понять, есть ли следующая страница
+        if after:
+            rows = await app.db_pool.fetch(
+                "SELECT currency_name, rate FROM currencies WHERE currency_name > $1 ORDER BY currency_name LIMIT $2",
+                after, limit + 1
+            )
+        else:
+            rows = await app.db_pool.fetch(
+                "SELECT currency_name, rate FROM currencies ORDER BY currency_name LIMIT $1", limit + 1
+            )
+    except asyncpg.PostgresError as e:
+        # Обработка ошибок базы данных
+        logger.error(f"Database error in get_currencies_page: {str(e)}")
+        return jsonify({"message": f"Database error: {str(e)}"}), 500
+
+    currencies = [{"currency_name": row["currency_name"], "rate": float(row["rate"])} for row in rows[:limit]]
+    next_after = currencies[-1]["currency_name"] if len(rows) > limit else None
+    logger.info(f"Retrieved page of {len(currencies)} currencies after {after}")
+    return jsonify({"currencies": currencies, "next_after": next_after}), 200
+
+# Функция для потоковой выдачи валют: строки читаются курсором порциями
+# и сразу отправляются клиенту, весь список в памяти не собирается
+def stream_currencies(after):
+    async def generate():
+        count = 0
+        try:
+            async with app.db_pool.acquire() as conn:
+                # Курсор asyncpg работает только внутри транзакции
+                async with conn.transaction():
+                    if after:
+                        cursor = conn.cursor(
+                            "SELECT currency_name, rate FROM currencies WHERE currency_name > $1 ORDER BY currency_name",
+                            after, prefetch=CURRENCIES_STREAM_BATCH
+                        )
+                    else:
+                        cursor = conn.cursor(
+                            "SELECT currency_name, rate FROM currencies ORDER BY currency_name",
+                            prefetch=CURRENCIES_STREAM_BATCH
+                        )
+                    async for row in cursor:
+                        count += 1
+                        yield (json.dumps({"currency_name": row["currency_name"], "rate": float(row["rate"])}) + "\n").encode()
+            logger.info(f"Streamed {count} currencies")
+        except asyncpg.PostgresError as e:
+            # Заголовки уже отправлены, поэтому ошибку можно только залогировать
+            logger.error(f"Database error while streaming currencies: {str(e)}")
+
+    return Response(generate(), status=200, mimetype='application/x-ndjson')
+
+if __name__ == '__main__':
+    uvicorn.run(
+        "data_manager_async:app",
+        host='0.0.0.0',
+        port=int(os.getenv("DATA_MANAGER_PORT", "5002")),
+        workers=int(os.getenv("DATA_MANAGER_WORKERS", "1"))
+    )
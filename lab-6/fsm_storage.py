@@ -0,0 +1,407 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from abc import abstractmethod
+from collections import OrderedDict
+from decimal import Decimal
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from dotenv import load_dotenv
+
+# Хранилища состояний FSM для ботов: общее для нескольких процессов хранилище
+# в PostgreSQL или в локальном файле SQLite, а также хранилище в памяти процесса,
+# которое удаляет брошенные диалоги
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Настройки хранилища из переменных окружения
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")  # memory, postgres или sqlite
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "fsm_states.sqlite3")
+# Кэш чтения и отложенная запись безопасны, только если все обновления одного чата
+# попадают в один процесс (polling или supervisor с раздачей по chat_id). Если процессы
+# делят порт (webhook с reuse_port), оставьте FSM_CACHE_TTL=0 и задайте FSM_FLUSH_INTERVAL=0 -
+# тогда каждое изменение сразу пишется в базу, а чтение всегда идёт из базы
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.05"))  # 0 - запись сразу при изменении
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "0"))  # 0 - без кэша чтения
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+# Настройки хранилища в памяти: брошенные диалоги удаляются по простою и по размеру
+FSM_MEMORY_IDLE_TTL = float(os.getenv("FSM_MEMORY_IDLE_TTL", "3600"))
+FSM_MEMORY_MAX_ENTRIES = int(os.getenv("FSM_MEMORY_MAX_ENTRIES", "100000"))
+FSM_MEMORY_SWEEP_INTERVAL = float(os.getenv("FSM_MEMORY_SWEEP_INTERVAL", "60"))
+
+# Сериализация данных состояния в JSON с сохранением Decimal (курсы из asyncpg)
+def encode_value(value):
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def decode_object(obj):
+    if "__decimal__" in obj and len(obj) == 1:
+        return Decimal(obj["__decimal__"])
+    return obj
+
+def dump_data(data: dict) -> str:
+    return json.dumps(data, default=encode_value)
+
+def load_data(raw: str) -> dict:
+    return json.loads(raw, object_hook=decode_object) if raw else {}
+
+# Строковый ключ записи, одинаковый для всех процессов
+def make_key(key: StorageKey) -> str:
+    return ":".join(str(part) if part is not None else "" for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id,
+        getattr(key, "business_connection_id", None), key.destiny
+    ))
+
+# Базовое хранилище с локальным кэшем чтения и пакетной записью.
+# Изменения копятся в памяти и раз в FSM_FLUSH_INTERVAL секунд записываются
+# в базу одним пакетом; при остановке бота несохранённые изменения дописываются.
+# В кэш попадают только записи, изменённые этим процессом: промах всегда читается из базы
+class BufferedStorage(BaseStorage):
+    def __init__(self, flush_interval=FSM_FLUSH_INTERVAL, cache_ttl=FSM_CACHE_TTL, cache_size=FSM_CACHE_SIZE):
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # ключ -> (state, data, срок действия)
+        self.pending = {}  # ключ -> (state, data), ещё не записанные в базу
+        self.flushing = {}  # пакет, который записывается прямо сейчас
+        self.flush_task = None
+        self.flush_lock = asyncio.Lock()
+
+    # Методы, которые реализует конкретная база
+    @abstractmethod
+    async def load(self, key: str):
+        ...
+
+    @abstractmethod
+    async def write_batch(self, upserts: list, deletes: list):
+        ...
+
+    async def close_backend(self):
+        pass
+
+    # Запуск фоновой записи (вызывается из main() после подключения к базе)
+    async def start(self, pool=None):
+        if self.flush_task is None and self.flush_interval > 0:
+            self.flush_task = asyncio.create_task(self.flush_loop())
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"FSM storage flush failed: {str(e)}")
+
+    # Запись накопленных изменений одним пакетом
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            self.flushing = batch
+            upserts = [(key, state, dump_data(data)) for key, (state, data) in batch.items() if state or data]
+            deletes = [key for key, (state, data) in batch.items() if not state and not data]
+            try:
+                await self.write_batch(upserts, deletes)
+            except Exception:
+                # Возвращаем изменения в очередь, если за это время их не перезаписали
+                for key, record in batch.items():
+                    self.pending.setdefault(key, record)
+                raise
+            finally:
+                self.flushing = {}
+
+    async def read(self, key: str):
+        if key in self.pending:
+            return self.pending[key]
+        if key in self.flushing:
+            return self.flushing[key]
+        cached = self.cache.get(key)
+        if cached and cached[2] > time.monotonic():
+            self.cache.move_to_end(key)
+            return cached[0], cached[1]
+        return await self.load(key) or (None, {})
+
+    def remember(self, key: str, state, data: dict):
+        if self.cache_ttl <= 0:
+            return
+        self.cache[key] = (state, data, time.monotonic() + self.cache_ttl)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def write(self, key: str, state, data: dict):
+        self.pending[key] = (state, data)
+        self.remember(key, state, data)
+        # Без фоновой записи изменение сразу уходит в базу
+        if self.flush_interval <= 0:
+            await self.flush()
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        storage_key = make_key(key)
+        _, data = await self.read(storage_key)
+        await self.write(storage_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey):
+        state, _ = await self.read(make_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        storage_key = make_key(key)
+        state, _ = await self.read(storage_key)
+        await self.write(storage_key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> dict:
+        _, data = await self.read(make_key(key))
+        return dict(data)
+
+    async def close(self) -> None:
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        try:
+            await self.flush()
+        finally:
+            await self.close_backend()
+
+# Хранилище в PostgreSQL: использует пул asyncpg бота, а если пула нет -
+# создаёт свой по тем же переменным окружения DB_*
+class PostgresStorage(BufferedStorage):
+    def __init__(self, table="fsm_states", **kwargs):
+        super().__init__(**kwargs)
+        self.table = table
+        self.pool = None
+        self.own_pool = False
+
+    async def start(self, pool=None):
+        if pool is None:
+            import asyncpg
+            pool = await asyncpg.create_pool(
+                user=os.getenv("DB_USER"),
+                password=os.getenv("DB_PASSWORD"),
+                host=os.getenv("DB_HOST"),
+                port=os.getenv("DB_PORT"),
+                database=os.getenv("DB_NAME"),
+                min_size=1,
+                max_size=2
+            )
+            self.own_pool = True
+        self.pool = pool
+        async with self.pool.acquire() as conn:
+            await conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                key VARCHAR PRIMARY KEY,
+                state VARCHAR,
+                data TEXT NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            ''')
+        await super().start()
+
+    async def load(self, key: str):
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(f"SELECT state, data FROM {self.table} WHERE key = $1", key)
+        return (row["state"], load_data(row["data"])) if row else None
+
+    async def write_batch(self, upserts: list, deletes: list):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                if upserts:
+                    await conn.executemany(f'''
+                        INSERT INTO {self.table} (key, state, data) VALUES ($1, $2, $3)
+                        ON CONFLICT (key) DO UPDATE
+                        SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = now()
+                    ''', upserts)
+                if deletes:
+                    await conn.execute(f"DELETE FROM {self.table} WHERE key = ANY($1::varchar[])", deletes)
+
+    async def close_backend(self):
+        if self.own_pool and self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+# Хранилище в локальном файле SQLite (общий файл для процессов на одной машине)
+class SQLiteStorage(BufferedStorage):
+    def __init__(self, path=FSM_SQLITE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.conn = None
+        self.lock = asyncio.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL позволяет читать файл из других процессов во время записи
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL
+        )
+        ''')
+        conn.commit()
+        return conn
+
+    async def start(self, pool=None):
+        if self.conn is None:
+            self.conn = await asyncio.to_thread(self.connect)
+        await super().start()
+
+    def load_sync(self, key: str):
+        row = self.conn.execute("SELECT state, data FROM fsm_states WHERE key = ?", (key,)).fetchone()
+        return (row[0], load_data(row[1])) if row else None
+
+    def write_batch_sync(self, upserts: list, deletes: list):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO fsm_states (key, state, data) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET state = excluded.state, data = excluded.data",
+                upserts
+            )
+            self.conn.executemany("DELETE FROM fsm_states WHERE key = ?", [(key,) for key in deletes])
+
+    async def load(self, key: str):
+        async with self.lock:
+            return await asyncio.to_thread(self.load_sync, key)
+
+    async def write_batch(self, upserts: list, deletes: list):
+        async with self.lock:
+            await asyncio.to_thread(self.write_batch_sync, upserts, deletes)
+
+    async def close_backend(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+# Примерный объём записи в памяти (без учёта вложенных объектов значений)
+def estimate_size(state, data: dict) -> int:
+    size = sys.getsizeof(state) + sys.getsizeof(data)
+    for name, value in data.items():
+        size += sys.getsizeof(name) + sys.getsizeof(value)
+    return size
+
+# Хранилище в памяти процесса с вытеснением: запись удаляется, если диалог
+# не трогали дольше FSM_MEMORY_IDLE_TTL секунд, а при превышении
+# FSM_MEMORY_MAX_ENTRIES вытесняются давно не использованные записи
+class EvictingMemoryStorage(BaseStorage):
+    def __init__(self, idle_ttl=FSM_MEMORY_IDLE_TTL, max_entries=FSM_MEMORY_MAX_ENTRIES,
+                 sweep_interval=FSM_MEMORY_SWEEP_INTERVAL):
+        self.idle_ttl = idle_ttl
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self.entries = OrderedDict()  # ключ -> (state, data, время последнего обращения, размер)
+        self.total_size = 0
+        self.evicted = {"idle": 0, "overflow": 0}
+        self.sweep_task = None
+
+    # Запуск фоновой очистки простаивающих записей
+    async def start(self, pool=None):
+        if self.sweep_task is None:
+            self.sweep_task = asyncio.create_task(self.sweep_loop())
+
+    async def sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                stats = self.stats()
+                logger.info(
+                    f"FSM memory storage evicted {removed} idle entries, "
+                    f"{stats['entries']} left (~{stats['approx_bytes']} bytes)"
+                )
+
+    # Удаление простаивающих записей: они упорядочены по времени обращения,
+    # поэтому просматриваем их с начала до первой свежей
+    def sweep(self) -> int:
+        deadline = time.monotonic() - self.idle_ttl
+        removed = 0
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry[2] > deadline:
+                break
+            self.remove(key)
+            removed += 1
+        self.evicted["idle"] += removed
+        return removed
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_size -= entry[3]
+
+    def read(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, {}
+        if entry[2] <= time.monotonic() - self.idle_ttl:
+            self.remove(key)
+            self.evicted["idle"] += 1
+            return None, {}
+        # Обращение продлевает жизнь записи
+        self.entries[key] = (entry[0], entry[1], time.monotonic(), entry[3])
+        self.entries.move_to_end(key)
+        return entry[0], entry[1]
+
+    def write(self, key, state, data: dict):
+        self.remove(key)
+        # Пустая запись (состояние сброшено и данных нет) не хранится
+        if state is None and not data:
+            return
+        size = estimate_size(state, data)
+        self.entries[key] = (state, data, time.monotonic(), size)
+        self.total_size += size
+        while len(self.entries) > self.max_entries:
+            self.remove(next(iter(self.entries)))
+            self.evicted["overflow"] += 1
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        _, data = self.read(key)
+        self.write(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey):
+        state, _ = self.read(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        state, _ = self.read(key)
+        self.write(key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> dict:
+        _, data = self.read(key)
+        return dict(data)
+
+    # Показатели для мониторинга: число живых записей и примерный объём в байтах
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "approx_bytes": self.total_size, **{
+            f"evicted_{reason}": count for reason, count in self.evicted.items()
+        }}
+
+    async def close(self) -> None:
+        if self.sweep_task:
+            self.sweep_task.cancel()
+            self.sweep_task = None
+        self.entries.clear()
+        self.total_size = 0
+
+# Функция для создания хранилища по переменной окружения FSM_STORAGE
+# options - параметры буферизации (flush_interval, cache_ttl, cache_size) для postgres и sqlite
+def create_storage(kind=FSM_STORAGE, **options) -> BaseStorage:
+    if kind == "postgres":
+        return PostgresStorage(**options)
+    if kind == "sqlite":
+        return SQLiteStorage(**options)
+    return EvictingMemoryStorage()
+
+# Функция для запуска хранилища в main() (фоновая запись или очистка памяти)
+async def start_storage(storage: BaseStorage, pool=None):
+    if isinstance(storage, (BufferedStorage, EvictingMemoryStorage)):
+        await storage.start(pool)
+        logger.info(f"FSM storage started: {type(storage).__name__}")
@@ -0,0 +1,104 @@
+from flask import request, g, Response
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+import time
+
+# Общие метрики для Flask-сервисов (data_manager и currency_manager) в формате Prometheus
+
+# Время обработки запроса по маршрутам
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route"]
+)
+# Ответы с ошибкой по маршрутам и кодам
+HTTP_ERRORS = Counter(
+    "http_errors_total",
+    "Количество ответов с кодом ошибки",
+    ["method", "route", "status"]
+)
+# Время выполнения запросов к БД по типу операции
+QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "Время выполнения запроса к базе данных",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+# Время получения соединения из пула
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_seconds",
+    "Время получения соединения из пула",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+)
+# Отказы в выдаче соединения из-за исчерпания пула
+POOL_EXHAUSTED = Counter(
+    "db_pool_exhausted_total",
+    "Количество отказов при исчерпании пула соединений"
+)
+POOL_IN_USE = Gauge("db_pool_connections_in_use", "Соединения, выданные из пула")
+POOL_IDLE = Gauge("db_pool_connections_idle", "Свободные соединения в пуле")
+POOL_MAX = Gauge("db_pool_connections_max", "Максимальный размер пула")
+
+# Курсор, который замеряет время выполнения каждого запроса
+class TimedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            QUERY_LATENCY.labels(query_operation(query)).observe(time.perf_counter() - start)
+
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            QUERY_LATENCY.labels("COPY").observe(time.perf_counter() - start)
+
+# Функция для определения типа операции по тексту запроса (SELECT, INSERT, WITH, ...)
+def query_operation(query):
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    words = str(query).split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+# Пул соединений, который учитывает время выдачи соединений и исчерпание пула
+class InstrumentedConnectionPool(pool.SimpleConnectionPool):
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        kwargs.setdefault("cursor_factory", TimedCursor)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        POOL_IN_USE.set_function(lambda: len(self._used))
+        POOL_IDLE.set_function(lambda: len(self._pool))
+        POOL_MAX.set(maxconn)
+
+    def getconn(self, key=None):
+        start = time.perf_counter()
+        try:
+            return super().getconn(key)
+        except pool.PoolError:
+            POOL_EXHAUSTED.inc()
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+# Функция для подключения метрик к Flask-приложению и регистрации маршрута /metrics
+def init_metrics(app):
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        started = g.pop("request_started", None)
+        if started is not None:
+            REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - started)
+        if response.status_code >= 400:
+            HTTP_ERRORS.labels(request.method, route, str(response.status_code)).inc()
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
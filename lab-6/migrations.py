@@ -0,0 +1,17 @@
+import importlib.util
+import os
+
+# Миграции схемы общие с ботом из lab-5: оба бота пишут в одну таблицу
+# schema_migrations под одной advisory-блокировкой, поэтому список миграций
+# должен быть один. Здесь загружается lab-5/migrations.py, своих миграций нет
+
+_spec = importlib.util.spec_from_file_location(
+    "lab5_migrations",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lab-5", "migrations.py")
+)
+_migrations = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_migrations)
+
+MIGRATIONS = _migrations.MIGRATIONS
+MIGRATIONS_LOCK_ID = _migrations.MIGRATIONS_LOCK_ID
+run_migrations = _migrations.run_migrations
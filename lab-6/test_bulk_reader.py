@@ -0,0 +1,92 @@
+import json
+import unittest
+from unittest import mock
+
+# currency_manager открывает пул соединений при импорте; BulkRowReader база
+# не нужна, поэтому на время импорта пул подменяется заглушкой
+with mock.patch("metrics.InstrumentedConnectionPool"):
+    from currency_manager import BulkRowReader, BULK_REJECT_SAMPLE
+
+# Функция для чтения всех строк для COPY и отчёта об отклонённых строках
+def read_all(lines, fmt):
+    reader = BulkRowReader(iter(lines), fmt)
+    return reader.read(), reader
+
+# Тесты проверки и преобразования строк массовой загрузки в строки COPY
+class TestBulkRowReader(unittest.TestCase):
+    # CSV: заголовок пропускается, название приводится к верхнему регистру, строки нумеруются
+    def test_csv_rows(self):
+        data, reader = read_all([b"currency_name,rate\n", b" usd ,90.5\n", b"\n", b"EUR,98.2\n"], "csv")
+        self.assertEqual(data, "1,USD,90.5\r\n2,EUR,98.2\r\n")
+        self.assertEqual(reader.rejected, 0)
+
+    # Заголовок пропускается только в первой строке
+    def test_csv_header_only_on_first_line(self):
+        data, reader = read_all([b"USD,90.5\n", b"currency_name,rate\n"], "csv")
+        self.assertEqual(data, "1,USD,90.5\r\n")
+        self.assertEqual(reader.rejects, [{"line": 2, "reason": "Invalid rate value"}])
+
+    def test_ndjson_rows(self):
+        lines = [
+            json.dumps({"currency_name": "usd", "rate": 90.5}).encode(),
+            b'{"currency_name": "EUR", "rate": "98.2"}',
+        ]
+        data, reader = read_all(lines, "ndjson")
+        self.assertEqual(data, "1,USD,90.5\r\n2,EUR,98.2\r\n")
+        self.assertEqual(reader.rejected, 0)
+
+    # Некорректные строки не попадают в COPY, а перечисляются с номером строки
+    def test_csv_rejects(self):
+        lines = [b"USD\n", b",90\n", b"EUR,abc\n", b"GBP,0\n", b"JPY,-1\n", b"CNY,NaN\n", b"KZT,5.1\n"]
+        data, reader = read_all(lines, "csv")
+        self.assertEqual(data, "1,KZT,5.1\r\n")
+        self.assertEqual(reader.rejects, [
+            {"line": 1, "reason": "Malformed line: expected 2 columns"},
+            {"line": 2, "reason": "Missing currency_name"},
+            {"line": 3, "reason": "Invalid rate value"},
+            {"line": 4, "reason": "Invalid rate value"},
+            {"line": 5, "reason": "Invalid rate value"},
+            {"line": 6, "reason": "Invalid rate value"},
+        ])
+
+    def test_ndjson_rejects(self):
+        lines = [b"not json", b"[1, 2]", b'{"rate": 1}', b'{"currency_name": "USD"}']
+        data, reader = read_all(lines, "ndjson")
+        self.assertEqual(data, "")
+        self.assertEqual([reject["line"] for reject in reader.rejects], [1, 2, 3, 4])
+        self.assertTrue(reader.rejects[0]["reason"].startswith("Malformed line"))
+        self.assertEqual(reader.rejects[2]["reason"], "Missing currency_name")
+        self.assertEqual(reader.rejects[3]["reason"], "Invalid rate value")
+
+    # Курс должен помещаться в NUMERIC(20, 10) и не округляться до нуля
+    def test_rate_range(self):
+        lines = [
+            b"MAX,9999999999.9999999999\n",
+            b"MIN,0.0000000001\n",
+            b"BIG,10000000000\n",
+            b"ROUND,9999999999.99999999999\n",
+            b"TINY,0.00000000001\n",
+            b"HUGE,1e40\n",
+        ]
+        data, reader = read_all(lines, "csv")
+        self.assertEqual(data, "1,MAX,9999999999.9999999999\r\n2,MIN,1E-10\r\n")
+        self.assertEqual(reader.rejects, [{"line": line, "reason": "Rate value out of range"} for line in (3, 4, 5, 6)])
+
+    # В отчёт попадают только первые BULK_REJECT_SAMPLE отклонённых строк, но считаются все
+    def test_reject_sample_limit(self):
+        data, reader = read_all([b"USD,abc\n"] * (BULK_REJECT_SAMPLE + 5), "csv")
+        self.assertEqual(data, "")
+        self.assertEqual(reader.rejected, BULK_REJECT_SAMPLE + 5)
+        self.assertEqual(len(reader.rejects), BULK_REJECT_SAMPLE)
+
+    # COPY читает данные кусками произвольного размера
+    def test_read_in_chunks(self):
+        reader = BulkRowReader(iter([b"USD,90.5\n", b"EUR,98.2\n"]), "csv")
+        chunks = []
+        while chunk := reader.read(5):
+            chunks.append(chunk)
+        self.assertEqual("".join(chunks), "1,USD,90.5\r\n2,EUR,98.2\r\n")
+        self.assertTrue(all(len(chunk) <= 5 for chunk in chunks))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import unittest
+import httpx
+
+# bot6 читает токен при импорте, для тестов подходит любой корректный по формату
+os.environ.setdefault("API_TOKEN", "123:abc")
+import bot6
+from bot6 import CircuitBreaker, ServiceUnavailableError
+
+# Тесты переходов предохранителя: closed -> open -> half_open -> closed/open
+class TestCircuitBreaker(unittest.TestCase):
+    # Предохранитель размыкается после заданного числа отказов подряд
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.snapshot()["rejected"], 1)
+
+    # Успех между отказами сбрасывает счётчик
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+
+    # После паузы пропускается один пробный вызов, его успех замыкает предохранитель
+    def test_half_open_probe_success_closes(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, "half_open")
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
+
+    # Отказ пробного вызова снова размыкает предохранитель
+    def test_half_open_probe_failure_reopens(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        breaker.opened_at -= 60
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    # Неожиданная ошибка пробного вызова не оставляет предохранитель в half_open навсегда
+    def test_unexpected_probe_error_releases_probe(self):
+        def raise_decoding_error(request):
+            raise httpx.DecodingError("broken body", request=request)
+
+        async def scenario():
+            breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+            bot6.breakers["test"] = breaker
+            bot6.dp["test_client"] = httpx.AsyncClient(
+                base_url="http://test", transport=httpx.MockTransport(raise_decoding_error)
+            )
+            try:
+                for _ in range(3):
+                    with self.assertRaises(ServiceUnavailableError):
+                        await bot6.call_service("test", "POST", "/load")
+                    self.assertFalse(breaker.probe_in_flight)
+                self.assertEqual(breaker.snapshot()["rejected"], 0)
+            finally:
+                await bot6.dp["test_client"].aclose()
+                del bot6.breakers["test"]
+
+        asyncio.run(scenario())
+
+if __name__ == '__main__':
+    unittest.main()